@@ -0,0 +1,230 @@
+import warnings
+warnings.filterwarnings("ignore", category=UserWarning, module="jieba")
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import jieba
+import logging
+from time import perf_counter
+from constant import N, correct_threshold
+jieba.setLogLevel(logging.ERROR)
+
+def get_percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(percent / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def summarize(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+        "p50_ms": get_percentile(latencies, 50) * 1000,
+        "p95_ms": get_percentile(latencies, 95) * 1000,
+        "p99_ms": get_percentile(latencies, 99) * 1000,
+        "sentences_per_second": len(latencies) / elapsed if elapsed > 0 else 0.0,
+    }
+
+def timed_run(func, items):
+    latencies = []
+    start = perf_counter()
+    for item in items:
+        t = perf_counter()
+        func(item)
+        latencies.append(perf_counter() - t)
+    return summarize(latencies, perf_counter() - start)
+
+def bench_correct(corrector, sentences, threshold):
+    # Inputs already scoring above the threshold return before any search, so the
+    # fraction that was searched is reported next to the latencies.
+    from sentence_evaluator import calculate_ngram_score
+    searched = sum(calculate_ngram_score(s, corrector.ngram_model, n_order=N) < threshold for s in sentences)
+    outcomes = []
+    result = timed_run(lambda s: outcomes.append(corrector.correct(s, threshold=threshold)), sentences)
+    result["searched"] = searched / len(sentences)
+    result["corrected"] = sum(is_corrected for _, _, is_corrected in outcomes) / len(sentences)
+    return result
+
+def get_synthetic_words(n_words, rng):
+    jieba.initialize()
+    words = [w for w, f in jieba.dt.FREQ.items() if f >= 1000 and all('一' <= c <= '龥' for c in w)]
+    words.sort()
+    rng.shuffle(words)
+    return words[:n_words]
+
+def generate_corpus(work_dir, rng, n_lines=20000, n_words=3000):
+    words = get_synthetic_words(n_words, rng)
+    phrases = ["".join(rng.choice(words) for _ in range(rng.randint(2, 4))) for _ in range(200)]
+    with open(os.path.join(work_dir, "corpus_cleaned_metadata.txt"), "w", encoding="utf-8") as w:
+        for _ in range(n_lines):
+            parts = [rng.choice(phrases)] + [rng.choice(words) for _ in range(rng.randint(2, 8))]
+            rng.shuffle(parts)
+            w.write("".join(parts) + "\n")
+    with open(os.path.join(work_dir, "corpus_cleaned_novels.txt"), "w", encoding="utf-8") as w:
+        for _ in range(n_lines // 4):
+            w.write("".join(rng.choice(words) for _ in range(rng.randint(3, 12))) + "\n")
+    with open(os.path.join(work_dir, "corpus_cleaned_thu.txt"), "w", encoding="utf-8") as w:
+        for word in words:
+            w.write(word + "\n")
+
+def build_model(work_dir):
+    from get_lexicon import entry
+    from get_ngram import train_entry
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        entry()
+        train_entry()
+    finally:
+        os.chdir(cwd)
+
+def corrupt_sentence(sentence, candidate_index, get_key, rng):
+    tokens = jieba.lcut(sentence)
+    positions = list(range(len(tokens)))
+    rng.shuffle(positions)
+    for i in positions:
+        homophones = [t for t in candidate_index.get(get_key(tokens[i]), []) if t != tokens[i]]
+        if homophones:
+            tokens[i] = rng.choice(homophones)
+            break
+    return "".join(tokens)
+
+def get_test_sentences(work_dir, corrector, rng, n_sentences, lengths):
+    from get_lexicon import get_shared_token_key
+    with open(os.path.join(work_dir, "corpus_cleaned_metadata.txt"), "r", encoding="utf-8") as r:
+        lines = [line.strip() for line in r if line.strip()]
+
+    by_length = {}
+    for length in lengths:
+        sentences = []
+        while len(sentences) < n_sentences:
+            sentence = ""
+            while len(sentence) < length:
+                sentence += corrupt_sentence(rng.choice(lines), corrector.candidate_index, get_shared_token_key, rng) + "，"
+            sentences.append(sentence[:length])
+        by_length[length] = sentences
+    return by_length
+
+def bench_server(work_dir, sentences, n_clients, n_requests, concurrency):
+    from corrector_client import CorrectorClient
+    socket_path = os.path.join(work_dir, "corrector.sock")
+    server_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corrector_server.py")
+    proc = subprocess.Popen([sys.executable, server_script, "--mode", "async", "--socket", socket_path,
+                             "--concurrency", str(concurrency), "--model", os.path.join(work_dir, "ngram.bin"),
+                             "--lexicon", os.path.join(work_dir, "lexicon.bin"),
+                             # Clients repeat sentences, so a result cache would turn most requests into hits.
+                             "--result-cache", "0", "--result-cache-path", os.path.join(work_dir, "result_cache.json")],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 60
+        while not os.path.exists(socket_path):
+            if proc.poll() is not None or time.time() > deadline:
+                raise RuntimeError("corrector server failed to start")
+            time.sleep(0.05)
+
+        with CorrectorClient(socket_path) as warmup:
+            warmup.correct(sentences[0])
+
+        latencies = []
+        lock = threading.Lock()
+
+        def run_client(k):
+            local = []
+            with CorrectorClient(socket_path) as client:
+                for j in range(n_requests):
+                    t = perf_counter()
+                    client.correct(sentences[(k * n_requests + j) % len(sentences)])
+                    local.append(perf_counter() - t)
+            with lock:
+                latencies.extend(local)
+
+        threads = [threading.Thread(target=run_client, args=(k,)) for k in range(n_clients)]
+        start = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        result = summarize(latencies, perf_counter() - start)
+        result["clients"] = n_clients
+        return result
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def run_benchmarks(args):
+    from corrector import SentenceCorrector
+    from sentence_evaluator import calculate_ngram_score
+
+    rng = random.Random(args.seed)
+    work_dir = args.workdir or tempfile.mkdtemp(prefix="corrector_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        if not os.path.exists(os.path.join(work_dir, "ngram.bin")):
+            generate_corpus(work_dir, rng)
+            build_model(work_dir)
+
+        corrector = SentenceCorrector(os.path.join(work_dir, "ngram.bin"), os.path.join(work_dir, "lexicon.bin"))
+        lengths = [int(x) for x in args.lengths.split(",")]
+        by_length = get_test_sentences(work_dir, corrector, rng, args.sentences, lengths)
+        all_sentences = [s for length in lengths for s in by_length[length]]
+        corrector.correct(all_sentences[0], threshold=args.threshold)
+
+        results = {"score": timed_run(lambda s: calculate_ngram_score(s, corrector.ngram_model, n_order=N), all_sentences)}
+        results["correct"] = {str(length): bench_correct(corrector, by_length[length], args.threshold) for length in lengths}
+        results["correct_forced"] = {str(length): bench_correct(corrector, by_length[length], math.inf) for length in lengths}
+        if not args.skip_server:
+            results["server"] = bench_server(work_dir, all_sentences, args.clients, args.requests, args.concurrency)
+
+        return {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "platform": platform.platform(),
+                "seed": args.seed,
+                "sentences_per_length": args.sentences,
+                "lengths": lengths,
+                "threshold": args.threshold,
+            },
+            "results": results,
+        }
+    finally:
+        if not args.workdir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--workdir", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sentences", type=int, default=20)
+    parser.add_argument("--lengths", default="8,16,32,64")
+    parser.add_argument("--threshold", type=float, default=correct_threshold)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--skip-server", action="store_true")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args)
+    with open(args.output, "w", encoding="utf-8") as w:
+        json.dump(report, w, ensure_ascii=False, indent=2)
+
+    for name, stats in report["results"].items():
+        for label, row in (stats.items() if name.startswith("correct") else [("", stats)]):
+            line = (f"{name + (':' + label if label else ''):<18} | p50 {row['p50_ms']:8.2f} ms | p95 {row['p95_ms']:8.2f} ms | "
+                    f"p99 {row['p99_ms']:8.2f} ms | {row['sentences_per_second']:8.1f} 句/秒")
+            if "corrected" in row:
+                line += f" | searched {row['searched']:6.1%} | corrected {row['corrected']:6.1%}"
+            print(line)
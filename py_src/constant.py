@@ -1,10 +1,48 @@
 import pypinyin
 
+# N-gram keys pack N token ids of 63 // N bits each into one integer, so N = 3 caps the
+# shared vocabulary at 2 ** 21 - 1 tokens (about 2.09M). get_ngram checks this.
 N = 3
+alpha = 0.0001
+ngram_min_count_per_order = [1, 2, 2]
+ngram_spill_threshold = 2000000
+ngram_merge_fanin = 256
+prune_min_count_per_order = [1, 2, 2]
+prune_loss_threshold = 1e-7
+prune_count_bits = 8
+prune_log_prob_bits = 16
 min_token_length_for_bi_key = 2
 soft_percent_for_bi_key_when_lower_than_min_token_length = 0.01
 correct_threshold = 210
 corrector_window_size = 4
+candidate_top_k = None
+decoder_mode = "greedy"
+beam_width = 4
+batch_scoring = False
+candidate_pruning = True
+candidate_bound_margin = 1e-6
+ngram_cache_entries = 200000
+segment_cache_entries = 20000
+candidate_cache_entries = 50000
 pinyin_mode = pypinyin.NORMAL
 encodings = ['utf-8', 'gb18030', 'gbk', 'utf-16']
+stream_batch_size = 20000
+stream_max_pending = 8
+dedupe_bucket_count = 64
+dedupe_bucket_max_bytes = 128 << 20
+tokenized_cache_dir = "tokenized_cache"
+encoding_cache_path = "encoding_cache.json"
+ngram_counts_path = "ngram.counts"
+unigram_counts_path = "unigram_counts.json"
+clean_chunk_size = 1 << 22
 
+
+server_max_concurrency = 4
+server_workers = None
+server_restart_delay = 1.0
+max_frame_size = 1 << 20
+stats_enabled = False
+result_cache_entries = 10000
+result_cache_path = None
+result_cache_save_interval = 256
+stream_max_sessions = 64
@@ -0,0 +1,121 @@
+import os
+import json
+import zlib
+import codecs
+import shutil
+import tempfile
+import threading
+from constant import encodings, dedupe_bucket_count, dedupe_bucket_max_bytes, encoding_cache_path
+
+def detect_encoding(filepath, sample_size=1 << 16):
+    with open(filepath, "rb") as r:
+        sample = r.read(sample_size)
+    for encoding in encodings:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return encodings[0]
+
+def load_encoding_cache(cache_path=encoding_cache_path):
+    try:
+        with open(cache_path, "r", encoding="utf-8") as r:
+            return json.load(r)
+    except (OSError, ValueError):
+        return {}
+
+def save_encoding_cache(cache, cache_path=encoding_cache_path):
+    with open(cache_path + ".tmp", "w", encoding="utf-8") as w:
+        json.dump(cache, w, ensure_ascii=False)
+    os.replace(cache_path + ".tmp", cache_path)
+
+def get_cached_encoding(filepath, cache):
+    stat = os.stat(filepath)
+    entry = cache.get(os.path.abspath(filepath))
+    if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+        return entry["encoding"]
+    encoding = detect_encoding(filepath)
+    cache[os.path.abspath(filepath)] = {"size": stat.st_size, "mtime": stat.st_mtime, "encoding": encoding}
+    return encoding
+
+def iter_lines(filepath, min_length=1):
+    if not os.path.exists(filepath):
+        return
+    with open(filepath, "r", encoding=detect_encoding(filepath), errors="replace") as r:
+        for line in r:
+            line = line.strip()
+            if len(line) >= min_length:
+                yield line
+
+def iter_bucket_lines(bucket_path):
+    with open(bucket_path, "r", encoding="utf-8") as r:
+        for line in r:
+            yield line.rstrip("\n")
+
+def iter_unique_lines(lines, n_buckets=dedupe_bucket_count, max_bucket_bytes=dedupe_bucket_max_bytes, level=0):
+    # Lines are spread over buckets by crc32 and each bucket is deduplicated in memory.
+    # A bucket larger than max_bucket_bytes is split again on the next bits of the
+    # hash, so peak memory stays bounded however large the corpus grows.
+    temp_dir = tempfile.mkdtemp()
+    try:
+        bucket_paths = [os.path.join(temp_dir, f"{i}.txt") for i in range(n_buckets)]
+        buckets = [open(p, "w", encoding="utf-8") for p in bucket_paths]
+        divisor = n_buckets ** level
+        try:
+            for line in lines:
+                buckets[zlib.crc32(line.encode("utf-8")) // divisor % n_buckets].write(line + "\n")
+        finally:
+            for bucket in buckets:
+                bucket.close()
+
+        for bucket_path in bucket_paths:
+            if os.path.getsize(bucket_path) > max_bucket_bytes and n_buckets ** (level + 1) < 1 << 32:
+                yield from iter_unique_lines(iter_bucket_lines(bucket_path), n_buckets, max_bucket_bytes, level + 1)
+            else:
+                seen = set()
+                for line in iter_bucket_lines(bucket_path):
+                    if line not in seen:
+                        seen.add(line)
+                        yield line
+            os.remove(bucket_path)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def bounded_imap(pool, func, iterable, max_pending, ordered=True):
+    # Pool.imap drains its input eagerly, so hold the feeder back until earlier
+    # results have been consumed. The feeder runs on the pool's task-handler
+    # thread, which terminate() joins, so it must also give up once the consumer
+    # stops or a worker raises.
+    semaphore = threading.BoundedSemaphore(max_pending)
+    stopped = threading.Event()
+
+    def feed():
+        for item in iterable:
+            while not semaphore.acquire(timeout=0.1):
+                if stopped.is_set():
+                    return
+            if stopped.is_set():
+                return
+            yield item
+
+    imap = pool.imap if ordered else pool.imap_unordered
+    try:
+        for result in imap(func, feed()):
+            semaphore.release()
+            yield result
+    finally:
+        stopped.set()
+
+def bounded_imap_unordered(pool, func, iterable, max_pending):
+    return bounded_imap(pool, func, iterable, max_pending, ordered=False)
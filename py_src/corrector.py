@@ -1,33 +1,103 @@
 import warnings
 warnings.filterwarnings("ignore", category=UserWarning, module="jieba")
 
+import os
 import json
+import hashlib
 import re
+import heapq
+import threading
 import pypinyin
-from time import time
-from sentence_evaluator import NgramModel, calculate_ngram_score
-from constant import N, correct_threshold, corrector_window_size, pinyin_mode
+from time import time, monotonic
+from sentence_evaluator import NgramModel, IncrementalScorer, calculate_ngram_score, score_id_batch, \
+    batch_scoring_available, segment_cache
+from get_lexicon import wrap_candidate_index
+from lexicon_store import LexiconStore, CandidateView, is_lexicon_store, get_default_lexicon_path
+from lru import LRUCache, MISSING
+from stats import stats
+from constant import N, alpha, correct_threshold, corrector_window_size, pinyin_mode, decoder_mode, beam_width, candidate_top_k, \
+    batch_scoring, candidate_pruning, stream_max_sessions, candidate_cache_entries
 
 class SentenceCorrector:
-    def __init__(self, model_path="ngram.db", lexicon_path="token_dict.json"):
+    def __init__(self, model_path="ngram.db", lexicon_path=None, incremental_scoring=True,
+                 decoder=decoder_mode, beam_width=beam_width, candidate_index_path="candidate_index.json", snapshot=None,
+                 batch_scoring=batch_scoring, candidate_pruning=candidate_pruning):
+        self.incremental_scoring = incremental_scoring
+        self.batch_scoring = batch_scoring and batch_scoring_available
+        self.candidate_pruning = candidate_pruning
+        self.decoder = decoder
+        self.beam_width = beam_width
+        self.sessions = LRUCache(stream_max_sessions, "stream_sessions")
+
+        if snapshot is not None:
+            self.model_files = [snapshot.path]
+            self.ngram_model = snapshot.get_ngram_model()
+            self.homophone_dict = snapshot.get_lexicon(candidate_top_k)
+            self.candidate_index = CandidateView(self.homophone_dict)
+            return
+
+        if lexicon_path is None:
+            lexicon_path = get_default_lexicon_path()
+        self.model_files = [model_path, lexicon_path]
         self.ngram_model = NgramModel(model_path)
+        if is_lexicon_store(lexicon_path):
+            self.homophone_dict = LexiconStore(lexicon_path, top_k=candidate_top_k)
+            self.candidate_index = CandidateView(self.homophone_dict)
+            return
 
         with open(lexicon_path, "r", encoding="utf-8") as r:
             self.homophone_dict = json.load(r)
 
-    def get_candidates_by_pinyin(self, text):
-        pinyin_results = [r[0] for r in pypinyin.pinyin(text, style=pinyin_mode)]
-        py_key = ",".join(pinyin_results)
-        candidates = self.homophone_dict.get(py_key, {})
-        return list(candidates.keys())
+        if candidate_index_path and os.path.exists(candidate_index_path):
+            self.model_files.append(candidate_index_path)
+            with open(candidate_index_path, "r", encoding="utf-8") as r:
+                self.candidate_index = json.load(r)
+        else:
+            self.candidate_index = wrap_candidate_index(self.homophone_dict, candidate_top_k)
+
+    def get_fingerprint(self):
+        # Identifies the loaded model files and the settings that shape results.
+        h = hashlib.sha1()
+        for path in self.model_files:
+            st = os.stat(path)
+            h.update(f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns};".encode("utf-8"))
+        h.update(repr((N, alpha, corrector_window_size, candidate_top_k, pinyin_mode, self.decoder, self.beam_width)).encode("utf-8"))
+        return h.hexdigest()
+
+    def get_cache_info(self):
+        caches = {}
+        if getattr(self.ngram_model, "cache", None) is not None:
+            caches["ngram"] = self.ngram_model.cache.info()
+        if segment_cache is not None:
+            caches["segment"] = segment_cache.info()
+        return caches
 
-    def get_ngram_count(self, gram, order_n):
-        self.cursor.execute('SELECT count FROM ngrams WHERE order_n = ? AND gram = ?', (order_n, gram))
-        result = self.cursor.fetchone()
-        return result[0] if result else 0
+    def prepare_fork(self):
+        # Built once here, the bound table is shared by forked workers instead of rebuilt in each.
+        if self.candidate_pruning:
+            self.ngram_model.get_token_max_log_prob(0)
 
-    def get_candidate_cache(self,char_list):
+    def after_fork(self):
+        self.ngram_model.after_fork()
+
+    def get_char_pinyins(self, char_list):
+        char_pinyins = list(char_list)
+        text = "".join(char_list)
+        for m in re.finditer(r'[\u4e00-\u9fa5]+', text):
+            pinyin_results = pypinyin.pinyin(m.group(), style=pinyin_mode)
+            char_pinyins[m.start():m.end()] = [r[0] for r in pinyin_results]
+        return char_pinyins
+
+    def get_candidates_by_pinyin(self, text):
+        py_key = ",".join(self.get_char_pinyins(text))
+        return self.candidate_index.get(py_key, [])
+
+    def get_candidate_cache(self,char_list, known=None):
+        start = stats.start()
         candidate_cache = {}
+        pinyin_start = stats.start()
+        char_pinyins = self.get_char_pinyins(char_list)
+        stats.stop("candidates.pinyin", pinyin_start)
         n = len(char_list)
         for i in range(n):
             if not re.match(r'[\u4e00-\u9fa5]', char_list[i]):
@@ -38,23 +108,35 @@ class SentenceCorrector:
                     continue
 
                 target_text = "".join(char_list[i: i + window_size])
-                candidates = self.get_candidates_by_pinyin(target_text)
-                candidate_cache[target_text] = candidates
+                py_key = ",".join(char_pinyins[i: i + window_size])
+                if known is None:
+                    candidate_cache[target_text] = self.candidate_index.get(py_key, [])
+                else:
+                    candidates = known.get(py_key)
+                    if candidates is MISSING:
+                        candidates = known.put(py_key, self.candidate_index.get(py_key, []))
+                    candidate_cache[target_text] = candidates
+                if stats.enabled:
+                    stats.incr("candidate_index.hits" if candidate_cache[target_text] else "candidate_index.misses")
+                    stats.incr("candidates.generated", len(candidate_cache[target_text]))
+        stats.stop("candidates.total", start)
         return candidate_cache
 
-    def single_correct(self, sentence, original_score, threshold):
+    def single_correct(self, sentence, original_score, threshold, deadline=None, scorer=None, known_candidates=None):
         if original_score >= threshold:
-            return sentence, original_score, False
+            return sentence, original_score, False, True
 
+        start = stats.start()
         best_sentence = sentence
         best_score = original_score
         is_corrected = False
+        finished = True
 
         char_list = list(sentence)
         n = len(char_list)
 
-        candidate_cache = self.get_candidate_cache(char_list)
-
+        candidate_cache = self.get_candidate_cache(char_list, known_candidates)
+        edits = []
         for i in range(n):
             if not re.match(r'[\u4e00-\u9fa5]', char_list[i]):
                 continue
@@ -64,40 +146,242 @@ class SentenceCorrector:
                     continue
 
                 target_text = "".join(char_list[i: i + window_size])
-                candidates = candidate_cache[target_text]
+                edits.extend((i, i + window_size, cand) for cand in candidate_cache[target_text] if cand != target_text)
 
-                for cand in candidates:
-                    if cand == target_text:
+        best_index = -1
+        if edits and (deadline is not None or self.candidate_pruning and self.incremental_scoring and not self.batch_scoring):
+            scorer = scorer or IncrementalScorer(sentence, self.ngram_model, n_order=N)
+            prune = self.candidate_pruning and self.incremental_scoring
+            if deadline is None:
+                bounds = [scorer.bound_edit(i, j, cand) for i, j, cand in edits]
+                order = sorted(range(len(edits)), key=lambda k: -bounds[k])
+            else:
+                # Against a deadline, windows over the least likely tokens go first and
+                # each edit is bounded only once it is reached.
+                priorities = [scorer.get_span_log_prob(i, j) for i, j, _ in edits]
+                order = sorted(range(len(edits)), key=lambda k: priorities[k])
+            n_scored = 0
+            for index in order:
+                if deadline is not None and monotonic() >= deadline:
+                    finished = False
+                    break
+                i, j, cand = edits[index]
+                if prune:
+                    bound = bounds[index] if deadline is None else scorer.bound_edit(i, j, cand)
+                    if bound < best_score:
+                        if deadline is None:
+                            break
                         continue
+                if self.incremental_scoring:
+                    new_score = scorer.score_edit(i, j, cand)
+                else:
+                    new_score = calculate_ngram_score(sentence[:i] + cand + sentence[j:], self.ngram_model, n_order=N)
+                n_scored += 1
+                # Equal scores go to the earliest edit, as in the in-order scan below.
+                if new_score > best_score or (new_score == best_score and 0 <= best_index and index < best_index):
+                    best_index, best_score = index, new_score
+        else:
+            if self.batch_scoring and edits:
+                scorer = scorer or IncrementalScorer(sentence, self.ngram_model, n_order=N)
+                edit_ids = [scorer.edit_ids(i, j, cand) for i, j, cand in edits]
+                scores = score_id_batch([ids for ids, _ in edit_ids], [lengths for _, lengths in edit_ids], self.ngram_model, n_order=N)
+            elif self.incremental_scoring:
+                scorer = scorer or IncrementalScorer(sentence, self.ngram_model, n_order=N)
+                scores = [scorer.score_edit(i, j, cand) for i, j, cand in edits]
+            else:
+                scores = [calculate_ngram_score(sentence[:i] + cand + sentence[j:], self.ngram_model, n_order=N)
+                          for i, j, cand in edits]
+            n_scored = len(edits)
+            for index, new_score in enumerate(scores):
+                if new_score > best_score:
+                    best_index, best_score = index, new_score
+
+        if best_index >= 0:
+            i, j, cand = edits[best_index]
+            best_sentence = sentence[:i] + cand + sentence[j:]
+            is_corrected = True
+
+        if stats.enabled:
+            stats.incr("correct.passes")
+            stats.incr("correct.candidates_scored", n_scored)
+            stats.incr("correct.candidates_pruned", len(edits) - n_scored)
+        stats.stop("correct.single_pass", start)
+        return best_sentence, best_score, is_corrected, finished
+
+    def beam_correct(self, sentence, threshold, beam_width=None, deadline=None, known_candidates=None):
+        start = stats.start()
+        beam_width = beam_width or self.beam_width
+        original_score = calculate_ngram_score(sentence, self.ngram_model, n_order=N)
+        if original_score >= threshold:
+            return sentence, original_score, False, True
 
-                    temp_chars = list(char_list)
-                    temp_chars[i: i + window_size] = list(cand)
-                    test_sentence = "".join(temp_chars)
+        char_list = list(sentence)
+        n = len(char_list)
+        candidate_cache = self.get_candidate_cache(char_list, known_candidates)
 
-                    new_score = calculate_ngram_score(test_sentence, self.ngram_model, n_order=N)
+        # lattice[pos] holds hypotheses whose first pos original chars are decided, as
+        # text -> (score of the full text, length shift against the original, scorer, edit).
+        # A hypothesis keeps its parent's scorer and the edit that produced it, and
+        # derives its own scorer only once it is expanded.
+        lattice = [{} for _ in range(n + 1)]
+        lattice[0][sentence] = (original_score, 0, None, None)
 
-                    if new_score > best_score:
-                        best_score = new_score
-                        best_sentence = test_sentence
-                        is_corrected = True
+        def push(pos, text, score, shift, scorer=None, edit=None):
+            if text not in lattice[pos] or lattice[pos][text][0] < score:
+                lattice[pos][text] = (score, shift, scorer, edit)
 
-        return best_sentence, best_score, is_corrected
+        finished = True
+        for pos in range(n):
+            hyps = heapq.nlargest(beam_width, lattice[pos].items(), key=lambda item: item[1][0])
+            for text, (score, shift, scorer, edit) in hyps:
+                if deadline is not None and monotonic() >= deadline:
+                    finished = False
+                    break
+                if not re.match(r'[\u4e00-\u9fa5]', char_list[pos]):
+                    push(pos + 1, text, score, shift, scorer, edit)
+                    continue
+                if self.incremental_scoring:
+                    if scorer is None:
+                        scorer = IncrementalScorer(text, self.ngram_model, n_order=N)
+                    elif edit is not None:
+                        scorer = scorer.apply_edit(*edit)
+                    edit = None
+                push(pos + 1, text, score, shift, scorer, edit)
 
-    def correct(self, sentence, threshold, n_correct = 4):
-        best_sentence, is_corrected = sentence, False
-        best_score = calculate_ngram_score(sentence, self.ngram_model, n_order=N)
+                edit_start = pos + shift
+                for window_size in range(1, corrector_window_size + 1):
+                    if pos + window_size > n:
+                        continue
+
+                    target_text = "".join(char_list[pos: pos + window_size])
+                    for cand in candidate_cache[target_text]:
+                        if cand == target_text:
+                            continue
+
+                        new_text = text[:edit_start] + cand + text[edit_start + window_size:]
+                        if self.incremental_scoring:
+                            new_score = scorer.score_edit(edit_start, edit_start + window_size, cand)
+                        else:
+                            new_score = calculate_ngram_score(new_text, self.ngram_model, n_order=N)
+                        push(pos + window_size, new_text, new_score, shift + len(cand) - window_size,
+                             scorer, (edit_start, edit_start + window_size, cand))
+                        if stats.enabled:
+                            stats.incr("correct.candidates_scored")
+            if not finished:
+                break
+
+        stats.stop("correct.beam", start)
+        # Every hypothesis is a full sentence, so a cut-off search still has a best one.
+        hypotheses = lattice[n] if finished else {text: entry for hyps in lattice for text, entry in hyps.items()}
+        best_sentence, (best_score, *_) = max(hypotheses.items(), key=lambda item: item[1][0])
+        if best_score <= original_score:
+            return sentence, original_score, False, finished
+        return best_sentence, best_score, True, finished
+
+    def correct_until(self, sentence, threshold, n_correct=4, decoder=None, deadline=None, session=None, known_candidates=None):
+        start = stats.start()
+        if stats.enabled:
+            stats.incr("correct.calls")
+        if session is not None:
+            known_candidates = session.candidates
+        if (decoder or self.decoder) == "beam":
+            result = self.beam_correct(sentence, threshold, deadline=deadline, known_candidates=known_candidates)
+            stats.stop("correct.total", start)
+            return result
+
+        best_sentence, is_corrected, finished = sentence, False, True
+        if session is not None:
+            best_score = session.get_scorer(0, sentence).score
+        else:
+            best_score = calculate_ngram_score(sentence, self.ngram_model, n_order=N)
         for n in range(n_correct):
-            better_sentence, better_score, current_sentence_is_corrected = self.single_correct(sentence=best_sentence,
-                                                                                               original_score=best_score,
-                                                                                               threshold=threshold)
+            if deadline is not None and monotonic() >= deadline:
+                finished = best_score >= threshold
+                break
+            scorer = session.get_scorer(n, best_sentence) if session is not None else None
+            better_sentence, better_score, current_sentence_is_corrected, finished = self.single_correct(sentence=best_sentence,
+                                                                                                         original_score=best_score,
+                                                                                                         threshold=threshold,
+                                                                                                         deadline=deadline,
+                                                                                                         scorer=scorer,
+                                                                                                         known_candidates=known_candidates)
             best_sentence = better_sentence
             best_score = max(best_score, better_score)
-            if not current_sentence_is_corrected:
+            is_corrected = is_corrected or current_sentence_is_corrected
+            if not current_sentence_is_corrected or not finished:
                 break
-            else:
-                is_corrected = is_corrected or current_sentence_is_corrected
 
-        return best_sentence, best_score, is_corrected
+        if stats.enabled and not finished:
+            stats.incr("correct.deadline_hits")
+        stats.stop("correct.total", start)
+        return best_sentence, best_score, is_corrected, finished
+
+    def correct(self, sentence, threshold, n_correct = 4, decoder=None):
+        return self.correct_until(sentence, threshold, n_correct, decoder)[:3]
+
+    def correct_within(self, sentence, threshold, deadline_ms, n_correct=4, decoder=None):
+        # correct() under a deadline_ms budget (None for none). The fourth field tells whether
+        # the search ran to completion or returned the best sentence found in time.
+        deadline = None if deadline_ms is None else monotonic() + deadline_ms / 1000
+        return self.correct_until(sentence, threshold, n_correct, decoder, deadline)
+
+    def correct_batch(self, sentences, threshold, n_correct = 4, decoder=None):
+        return [result[:3] for result in self.correct_batch_within(sentences, threshold, None, n_correct, decoder)]
+
+    def correct_batch_within(self, sentences, threshold, deadline_ms, n_correct=4, decoder=None):
+        # N-gram lookups are shared through the model's own LRU; pinyin window candidates
+        # are shared through a bounded memo that lives for the batch.
+        known_candidates = LRUCache(candidate_cache_entries, "batch_candidates")
+        deadline = None if deadline_ms is None else monotonic() + deadline_ms / 1000
+
+        results = {}
+        for sentence in sentences:
+            if sentence not in results:
+                results[sentence] = self.correct_until(sentence, threshold, n_correct, decoder, deadline,
+                                                       known_candidates=known_candidates)
+        return [results[sentence] for sentence in sentences]
+
+    def get_session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is MISSING:
+            session = self.sessions.setdefault(session_id, CorrectionSession(self))
+        return session
+
+    def close_session(self, session_id):
+        self.sessions.pop(session_id)
+
+class CorrectionSession:
+    # Corrects a growing partial sentence. Each pass keeps its scorer, so the next
+    # partial re-segments and re-scores only what its changed tail touches; every
+    # update returns exactly what correct() would for that partial.
+    def __init__(self, corrector):
+        self.corrector = corrector
+        self.candidates = LRUCache(candidate_cache_entries)
+        self.scorers = []
+        self.previous = []
+        self.lock = threading.Lock()
+
+    def get_scorer(self, pass_index, sentence):
+        if pass_index < len(self.scorers) and self.scorers[pass_index].sentence == sentence:
+            return self.scorers[pass_index]
+        base = self.previous[pass_index] if pass_index < len(self.previous) else None
+        scorer = IncrementalScorer(sentence, self.corrector.ngram_model, n_order=N, base=base)
+        del self.scorers[pass_index:]
+        self.scorers.append(scorer)
+        return scorer
+
+    def update(self, text, threshold=correct_threshold, n_correct=4):
+        return self.update_within(text, threshold, None, n_correct)[:3]
+
+    def update_within(self, text, threshold, deadline_ms, n_correct=4):
+        with self.lock:
+            deadline = None if deadline_ms is None else monotonic() + deadline_ms / 1000
+            self.scorers = []
+            try:
+                result = self.corrector.correct_until(text, threshold, n_correct, deadline=deadline, session=self)
+            finally:
+                self.previous = self.scorers + self.previous[len(self.scorers):]
+        return result
 
 if __name__ == '__main__':
     corrector = SentenceCorrector()
@@ -0,0 +1,82 @@
+import socket
+from protocol import encode_frame, recv_frame
+
+def get_result(response):
+    return response["result"], response["score"], response["is_corrected"]
+
+def get_result_within(response):
+    # Replies to requests with a deadline_ms budget carry "finished" as well.
+    return get_result(response) + (response["finished"],)
+
+def get_payload(payload, threshold=None, deadline_ms=None):
+    if threshold is not None:
+        payload["threshold"] = threshold
+    if deadline_ms is not None:
+        payload["deadline_ms"] = deadline_ms
+    return payload
+
+class CorrectorClient:
+    def __init__(self, socket_path="/tmp/corrector.sock", timeout=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path)
+        self.next_id = 0
+        self.pending = {}
+
+    def send(self, payload):
+        self.next_id += 1
+        payload = dict(payload, id=self.next_id)
+        self.sock.sendall(encode_frame(payload))
+        return self.next_id
+
+    def receive(self, request_id):
+        while request_id not in self.pending:
+            response = recv_frame(self.sock)
+            self.pending[response.get("id")] = response
+        return self.pending.pop(request_id)
+
+    def request(self, payload):
+        response = self.receive(self.send(payload))
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response
+
+    def correct(self, text, threshold=None):
+        return get_result(self.request(get_payload({"type": "correct", "text": text}, threshold)))
+
+    def correct_within(self, text, deadline_ms, threshold=None):
+        return get_result_within(self.request(get_payload({"type": "correct", "text": text}, threshold, deadline_ms)))
+
+    def correct_batch(self, texts, threshold=None):
+        response = self.request(get_payload({"type": "batch", "texts": list(texts)}, threshold))
+        return [get_result(r) for r in response["results"]]
+
+    def correct_batch_within(self, texts, deadline_ms, threshold=None):
+        response = self.request(get_payload({"type": "batch", "texts": list(texts)}, threshold, deadline_ms))
+        return [get_result_within(r) for r in response["results"]]
+
+    def stream(self, session, text, final=False, threshold=None):
+        payload = {"type": "stream", "session": session, "text": text, "final": final}
+        return get_result(self.request(get_payload(payload, threshold)))
+
+    def stream_within(self, session, text, deadline_ms, final=False, threshold=None):
+        payload = {"type": "stream", "session": session, "text": text, "final": final}
+        return get_result_within(self.request(get_payload(payload, threshold, deadline_ms)))
+
+    def reload(self, force=False):
+        return self.request({"type": "reload", "force": force})["version"]
+
+    def get_stats(self, reset=False, enable=None):
+        payload = {"type": "stats", "reset": reset}
+        if enable is not None:
+            payload["enable"] = enable
+        return self.request(payload)["stats"]
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -8,39 +8,408 @@ jieba.setLogLevel(logging.ERROR)
 import socket
 import os
 import sys
-from constant import correct_threshold
+import gc
+import signal
+import asyncio
+import argparse
+import threading
+import traceback
+from functools import partial
+from time import monotonic, sleep
+from concurrent.futures import ThreadPoolExecutor
+from constant import correct_threshold, server_max_concurrency, server_workers, server_restart_delay, result_cache_entries, \
+    result_cache_path
 from corrector import SentenceCorrector
+from result_cache import CachedCorrector
+from snapshot import Snapshot
+from lexicon_store import get_default_lexicon_path
+from protocol import encode_frame, decode_body, read_frame
+from stats import stats
 
-def start_server(socket_path="/tmp/corrector.sock"):
+def get_base_dir():
     if getattr(sys, 'frozen', False):
-        base_dir = os.path.dirname(sys.executable)
-    else:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+def load_corrector(m_path=None, l_path=None, s_path=None, cache_entries=result_cache_entries, cache_path=result_cache_path,
+                   background=True):
+    corrector = load_model(m_path, l_path, s_path, background)
+    if cache_entries:
+        return CachedCorrector(corrector, cache_entries, cache_path)
+    return corrector
+
+def save_corrector(corrector):
+    if isinstance(corrector, CachedCorrector):
+        corrector.save()
 
-    m_path = os.path.join(base_dir, "ngram.pkl")
-    l_path = os.path.join(base_dir, "token_dict.json")
+class ModelSlot:
+    # Holds the corrector that new requests are served from. A reload loads the current
+    # model files into a fresh corrector and swaps it in; requests already running keep
+    # the corrector they started with. Reloading unchanged files is a no-op. The fresh
+    # corrector's result cache only takes saved entries whose fingerprint matches, so
+    # results of the old model are dropped.
+    def __init__(self, corrector, load, supervisor_pid=None):
+        self.corrector = corrector
+        self.load = load
+        self.supervisor_pid = supervisor_pid
+        self.fingerprint = corrector.get_fingerprint()
+        self.version = 1
+        self.lock = threading.Lock()
 
-    corrector = SentenceCorrector(m_path, l_path)
+    def reload(self, force=False):
+        with self.lock:
+            if force or self.corrector.get_fingerprint() != self.fingerprint:
+                save_corrector(self.corrector)
+                corrector = self.load()
+                self.corrector, self.fingerprint = corrector, corrector.get_fingerprint()
+                self.version += 1
+            return self.version
+
+def load_model(m_path=None, l_path=None, s_path=None, background=True):
+    base_dir = get_base_dir()
+    if s_path is None and m_path is None and l_path is None:
+        s_path = os.path.join(base_dir, "model.snapshot")
+        s_path = s_path if os.path.exists(s_path) else None
+    if s_path:
+        snapshot = Snapshot(s_path)
+        snapshot.install_jieba(background)
+        return SentenceCorrector(snapshot=snapshot)
+
+    if m_path is None:
+        m_path = os.path.join(base_dir, "ngram.bin")
+        m_path = m_path if os.path.exists(m_path) else os.path.join(base_dir, "ngram.db")
+    if l_path is None:
+        l_path = get_default_lexicon_path(base_dir)
+    i_path = os.path.join(os.path.dirname(os.path.abspath(l_path)), "candidate_index.json")
+    if background:
+        threading.Thread(target=jieba.initialize, daemon=True).start()
+    else:
+        jieba.initialize()
+    return SentenceCorrector(m_path, l_path, candidate_index_path=i_path)
 
+def bind_unix_socket(socket_path):
     if os.path.exists(socket_path):
         os.remove(socket_path)
 
     server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
     server.bind(socket_path)
-    server.listen(5)
     os.chmod(socket_path, 0o666)
+    return server
+
+def start_server(socket_path="/tmp/corrector.sock", m_path=None, l_path=None, s_path=None,
+                 cache_entries=result_cache_entries, cache_path=result_cache_path):
+    corrector = load_corrector(m_path, l_path, s_path, cache_entries, cache_path)
+
+    server = bind_unix_socket(socket_path)
+    server.listen(5)
+
+    try:
+        while True:
+            conn, _ = server.accept()
+            try:
+                data = conn.recv(2048).decode('utf-8')
+                if data:
+                    result, _, _ = corrector.correct(data, threshold=correct_threshold)
+                    conn.sendall(result.encode('utf-8'))
+            except Exception:
+                pass
+            finally:
+                conn.close()
+    finally:
+        save_corrector(corrector)
+
+def get_deadline_ms(request):
+    # A "deadline_ms" budget bounds the search; replies then carry "finished".
+    deadline_ms = request.get("deadline_ms")
+    return None if deadline_ms is None else float(deadline_ms)
 
-    while True:
-        conn, _ = server.accept()
+def get_result_reply(result, deadline_ms):
+    reply = {"result": result[0], "score": result[1], "is_corrected": result[2]}
+    if deadline_ms is not None:
+        reply["finished"] = result[3]
+    return reply
+
+def handle_correct(corrector, request):
+    deadline_ms = get_deadline_ms(request)
+    result = corrector.correct_within(request["text"], request.get("threshold", correct_threshold), deadline_ms)
+    return get_result_reply(result, deadline_ms)
+
+def handle_batch(corrector, request):
+    deadline_ms = get_deadline_ms(request)
+    results = corrector.correct_batch_within(request["texts"], request.get("threshold", correct_threshold), deadline_ms)
+    return {"results": [get_result_reply(result, deadline_ms) for result in results]}
+
+def handle_stream(corrector, request):
+    # Partial hypotheses of one utterance share a "session" id; "final" ends it.
+    session_id = request["session"]
+    deadline_ms = get_deadline_ms(request)
+    result = corrector.get_session(session_id).update_within(request["text"], request.get("threshold", correct_threshold),
+                                                             deadline_ms)
+    if request.get("final"):
+        corrector.close_session(session_id)
+    return get_result_reply(result, deadline_ms)
+
+def handle_stats(corrector, request):
+    if "enable" in request:
+        stats.enabled = bool(request["enable"])
+    response = {"stats": stats.snapshot(), "caches": corrector.get_cache_info()}
+    if request.get("reset"):
+        stats.reset()
+    return response
+
+def handle_reload(models, request):
+    version = models.reload(bool(request.get("force")))
+    if models.supervisor_pid:
+        # The supervisor passes the reload on to the other workers.
+        os.kill(models.supervisor_pid, signal.SIGHUP)
+    return {"version": version}
+
+request_handlers = {
+    "correct": handle_correct,
+    "batch": handle_batch,
+    "stream": handle_stream,
+    "stats": handle_stats,
+}
+
+def handle_request(models, request):
+    request_type = request.get("type", "correct")
+    if request_type == "reload":
+        return handle_reload(models, request)
+    if request_type not in request_handlers:
+        raise ValueError(f"unknown request type {request_type!r}")
+    return request_handlers[request_type](models.corrector, request)
+
+def get_error_reply(request_id, e):
+    return {"id": request_id, "error": f"{type(e).__name__}: {e}"}
+
+async def serve_connection(reader, writer, models, executor, max_concurrency):
+    # At most max_concurrency requests of one connection are in flight; reading pauses
+    # until one of them has been answered, so a client cannot queue unbounded work.
+    loop = asyncio.get_running_loop()
+    write_lock = asyncio.Lock()
+    in_flight = asyncio.Semaphore(max_concurrency)
+    pending = set()
+
+    async def reply(response):
         try:
-            data = conn.recv(2048).decode('utf-8')
-            if data:
-                result, _, _ = corrector.correct(data, threshold=correct_threshold)
-                conn.sendall(result.encode('utf-8'))
-        except Exception:
+            frame = encode_frame(response)
+        except ValueError as e:
+            frame = encode_frame(get_error_reply(response.get("id"), e))
+        async with write_lock:
+            writer.write(frame)
+            await writer.drain()
+
+    async def process(request):
+        try:
+            try:
+                response = await loop.run_in_executor(executor, handle_request, models, request)
+                response["id"] = request.get("id")
+            except Exception as e:
+                response = get_error_reply(request.get("id"), e)
+            await reply(response)
+        finally:
+            in_flight.release()
+
+    try:
+        while True:
+            try:
+                body = await read_frame(reader)
+            except asyncio.IncompleteReadError:
+                break
+            except ValueError as e:
+                await reply(get_error_reply(None, e))
+                break
+
+            try:
+                request = decode_body(body)
+            except ValueError as e:
+                await reply(get_error_reply(None, e))
+                continue
+
+            await in_flight.acquire()
+            task = asyncio.create_task(process(request))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+    except ConnectionError:
+        pass
+    finally:
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        writer.close()
+
+async def reload_models(models, executor):
+    try:
+        await asyncio.get_running_loop().run_in_executor(executor, models.reload)
+    except Exception:
+        traceback.print_exc()
+
+async def serve_async(server_socket, models, max_concurrency):
+    # SIGTERM and SIGINT stop accepting and stop reading; requests already read are
+    # answered before this returns.
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    connections = set()
+    loop.add_signal_handler(signal.SIGHUP, lambda: loop.create_task(reload_models(models, executor)))
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+
+    async def serve(reader, writer):
+        task = asyncio.current_task()
+        connections.add(task)
+        try:
+            await serve_connection(reader, writer, models, executor, max_concurrency)
+        except asyncio.CancelledError:
+            # Only shutdown cancels a connection, after its pending requests were answered.
             pass
         finally:
-            conn.close()
+            connections.discard(task)
+
+    server = await asyncio.start_unix_server(serve, sock=server_socket)
+    try:
+        await stopping.wait()
+        server.close()
+        for task in list(connections):
+            task.cancel()
+        await asyncio.gather(*connections, return_exceptions=True)
+    finally:
+        executor.shutdown(wait=True)
+
+def start_async_server(socket_path="/tmp/corrector.sock", max_concurrency=server_max_concurrency, m_path=None, l_path=None,
+                       s_path=None, cache_entries=result_cache_entries, cache_path=result_cache_path):
+    load = partial(load_corrector, m_path, l_path, s_path, cache_entries, cache_path)
+    models = ModelSlot(load(), load)
+    try:
+        asyncio.run(serve_async(bind_unix_socket(socket_path), models, max_concurrency))
+    finally:
+        save_corrector(models.corrector)
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+stop_signals = {signal.SIGINT, signal.SIGTERM}
+
+def exit_worker(signum, frame):
+    os._exit(0)
+
+def run_worker(server_socket, corrector, load, max_concurrency):
+    # Before the loop runs there is nothing to finish, so SIGTERM/SIGINT exit at once;
+    # while it runs serve_async stops it, and afterwards they are ignored until the
+    # result cache is saved and fork_worker exits through os._exit(0).
+    signal.signal(signal.SIGINT, exit_worker)
+    signal.signal(signal.SIGTERM, exit_worker)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, stop_signals)
+    corrector.after_fork()
+    models = ModelSlot(corrector, load, supervisor_pid=os.getppid())
+    try:
+        asyncio.run(serve_async(server_socket, models, max_concurrency))
+    finally:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        save_corrector(models.corrector)
+
+def fork_worker(server_socket, corrector, load, max_concurrency):
+    # Stop signals stay blocked until the child has its own handlers, so the supervisor's
+    # handler never runs in a half-started worker.
+    signal.pthread_sigmask(signal.SIG_BLOCK, stop_signals)
+    pid = os.fork()
+    if pid:
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, stop_signals)
+        return pid
+    code = 1
+    try:
+        run_worker(server_socket, corrector, load, max_concurrency)
+        code = 0
+    except Exception:
+        traceback.print_exc()
+    finally:
+        os._exit(code)
+
+def start_prefork_server(socket_path="/tmp/corrector.sock", n_workers=server_workers, max_concurrency=server_max_concurrency,
+                         m_path=None, l_path=None, s_path=None, cache_entries=result_cache_entries, cache_path=result_cache_path):
+    # The supervisor loads the model once and forks workers that accept on one shared
+    # socket. The n-gram and lexicon stores are mmaps, so workers share their pages;
+    # everything else loaded here is shared copy-on-write.
+    # SIGHUP reloads every worker; the supervisor reloads its own copy before it next forks.
+    n_workers = n_workers or os.cpu_count() or 1
+    load = partial(load_corrector, m_path, l_path, s_path, cache_entries, cache_path, background=False)
+    corrector = load()
+    corrector.prepare_fork()
+    fingerprint = corrector.get_fingerprint()
+    server_socket = bind_unix_socket(socket_path)
+    server_socket.listen(100)
+    workers = {}
+    hangups = []
+
+    def forward_hangup(signum, frame):
+        hangups.append(signum)
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    signal.signal(signal.SIGHUP, forward_hangup)
+    gc.freeze()
+
+    try:
+        while True:
+            if hangups and len(workers) < n_workers:
+                hangups.clear()
+                if corrector.get_fingerprint() != fingerprint:
+                    corrector = load()
+                    corrector.prepare_fork()
+                    fingerprint = corrector.get_fingerprint()
+                    gc.freeze()
+            while len(workers) < n_workers:
+                workers[fork_worker(server_socket, corrector, load, max_concurrency)] = monotonic()
+            pid, status = os.wait()
+            started = workers.pop(pid, None)
+            if started is None:
+                continue
+            print(f"worker {pid} exited with code {os.waitstatus_to_exitcode(status)}, restarting", file=sys.stderr)
+            if monotonic() - started < server_restart_delay:
+                sleep(server_restart_delay)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in workers:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        server_socket.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
 
 if __name__ == '__main__':
-    start_server()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", default="/tmp/corrector.sock")
+    parser.add_argument("--mode", choices=["legacy", "async", "prefork"], default="legacy")
+    parser.add_argument("--concurrency", type=int, default=server_max_concurrency)
+    parser.add_argument("--workers", type=int, default=server_workers)
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--lexicon", default=None)
+    parser.add_argument("--snapshot", default=None)
+    parser.add_argument("--stats", action="store_true")
+    parser.add_argument("--result-cache", type=int, default=result_cache_entries)
+    parser.add_argument("--result-cache-path", default=result_cache_path)
+    args = parser.parse_args()
+
+    if args.stats:
+        stats.enabled = True
+
+    if args.mode == "prefork":
+        start_prefork_server(args.socket, args.workers, args.concurrency, args.model, args.lexicon, args.snapshot,
+                             args.result_cache, args.result_cache_path)
+    elif args.mode == "async":
+        start_async_server(args.socket, args.concurrency, args.model, args.lexicon, args.snapshot,
+                           args.result_cache, args.result_cache_path)
+    else:
+        start_server(args.socket, args.model, args.lexicon, args.snapshot, args.result_cache, args.result_cache_path)
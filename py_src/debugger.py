@@ -1,11 +1,10 @@
-import json
 from get_lexicon import get_shared_token_key
+from lexicon_store import load_lexicon, get_default_lexicon_path
+from sentence_evaluator import NgramModel
 
-def debug_tokens_status(target_words, bigram_pairs, data_path="token_dict.json"):
-    with open(data_path, "r", encoding="utf-8") as r:
-        data = json.load(r)
-        unigram = data.get("unigram", {})
-        bigram = data.get("bigram", {})
+def debug_tokens_status(target_words, bigram_pairs, data_path=None, model_path="ngram.db"):
+    unigram = load_lexicon(data_path or get_default_lexicon_path())
+    model = NgramModel(model_path)
 
     print(f"{'词语':<10} | {'拼音键':<20} | {'Unigram 词频':<10}")
     print("-" * 50)
@@ -20,20 +19,19 @@ def debug_tokens_status(target_words, bigram_pairs, data_path="token_dict.json")
 
     for pair in bigram_pairs:
         bi_key = "\t".join(pair)
-        count = bigram.get(bi_key, 0)
+        count = model.get_gram_count(list(pair))
         print(f"{bi_key:<20} | {count:<10}")
 
-def debug_sentence_logic(sentence, data):
+def debug_sentence_logic(sentence, model):
     import jieba
     tokens = jieba.lcut(sentence)
-    bigram = data["bigram"]
 
     print(f"\n{'Token对':<20} | {'Bigram频次':<10} | {'是否存在搭配'}")
     print("-" * 50)
 
     for i in range(1, len(tokens)):
         bi_key = f"{tokens[i - 1]}\t{tokens[i]}"
-        count = bigram.get(bi_key, 0)
+        count = model.get_gram_count(tokens[i - 1:i + 1])
         print(f"{bi_key:<20} | {count:<10} | {'√' if count > 0 else 'X'}")
 
 if __name__ == '__main__':
@@ -41,9 +39,7 @@ if __name__ == '__main__':
     pairs_to_check = [("深钻", "细研"), ("深钻", "戏言")]
     debug_tokens_status(words_to_check, pairs_to_check)
 
-    with open("token_dict.json", "r", encoding="utf-8") as r:
-        data = json.load(r)
-        debug_sentence_logic("阿巴阿巴运算速度极其缓慢的香蕉皮", data)
+    debug_sentence_logic("阿巴阿巴运算速度极其缓慢的香蕉皮", NgramModel("ngram.db"))
 
     sent1 = "炮也打好了"
     sent2 = "炮眼打好了"
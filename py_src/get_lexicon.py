@@ -1,40 +1,47 @@
 import os
 import json
-import warnings
-warnings.filterwarnings("ignore", category=UserWarning, module="jieba")
-
-import jieba
-import logging
+import argparse
 import pypinyin
-from multiprocessing import Pool, cpu_count
-from constant import encodings, pinyin_mode, min_token_length_for_bi_key, soft_percent_for_bi_key_when_lower_than_min_token_length
-jieba.setLogLevel(logging.ERROR)
+from collections import Counter
+from corpus_stream import iter_unique_lines
+from tokenized_corpus import tokenize_corpus, load_vocab, iter_token_ids
+from constant import pinyin_mode, min_token_length_for_bi_key, soft_percent_for_bi_key_when_lower_than_min_token_length, \
+    unigram_counts_path
+from lexicon_store import LexiconStore, build_lexicon_store
+
+# Unigrams are counted per source and kept raw, so a delta can be added to one source
+# and the others re-weighted against the new metadata total.
+lexicon_sources = [("metadata", "corpus_cleaned_metadata.txt", 4),
+                   ("novels", "corpus_cleaned_novels.txt", 4),
+                   ("thu", "corpus_cleaned_thu.txt", 2)]
+lexicon_source_weights = [("novels", 0.1), ("thu", 0.25)]
 
 def get_shared_token_key(token):
     pinyins = pypinyin.lazy_pinyin(token, style=pinyin_mode)
     return ','.join(pinyins)
 
-def process_chunk_task(sentences_chunk):
-    local_unigram = {}
-    for s in sentences_chunk:
-        tokens = jieba.lcut(s)
-        for i, token in enumerate(tokens):
-            local_unigram[token] = local_unigram.get(token, 0) + 1
-    return local_unigram
+def get_streaming_data(filepath, min_length):
+    corpus_dir = tokenize_corpus(filepath)
+    if corpus_dir is None:
+        return {}
 
-def get_parallel_data(sentences):
-    num_workers = cpu_count()
-    chunk_size = max(1, len(sentences) // num_workers)
-    chunks = [sentences[i:i + chunk_size] for i in range(0, len(sentences), chunk_size)]
+    vocab = load_vocab(corpus_dir)
+    token_lengths = [len(token) for token in vocab]
 
-    with Pool(num_workers) as pool:
-        results = pool.map(process_chunk_task, chunks)
+    # Dedupe emits lines in hash order, so the order in which tokens first appear on a
+    # counted line is taken from the file before it.
+    first_seen = {}
+    def iter_counted_lines():
+        for ids in iter_token_ids(corpus_dir):
+            if sum(token_lengths[i] for i in ids) >= min_length:
+                first_seen.update(dict.fromkeys(ids))
+                yield " ".join(map(str, ids))
 
-    combined_unigram = {}
-    for uni in results:
-        for k, v in uni.items(): combined_unigram[k] = combined_unigram.get(k, 0) + v
+    id_counter = Counter()
+    for line in iter_unique_lines(iter_counted_lines()):
+        id_counter.update(map(int, line.split(" ")))
 
-    return combined_unigram
+    return {vocab[i]: id_counter[i] for i in first_seen}
 
 def get_filepaths(directory, extension="txt"):
     filepaths = []
@@ -44,15 +51,6 @@ def get_filepaths(directory, extension="txt"):
                 filepaths.append(os.path.join(root, _file))
     return filepaths
 
-def get_lines_with_auto_encoding_mode(filepath):
-    for encoding_mode in encodings:
-        try:
-            with open(filepath, "r", encoding=encoding_mode) as r:
-                return r.readlines()
-        except:
-            pass
-    return []
-
 def wrap_token_dict(unigram_dict):
     token_dict = {}
     for token, freq in unigram_dict.items():
@@ -64,22 +62,33 @@ def wrap_token_dict(unigram_dict):
         token_dict[shared_key][token] = freq
     return token_dict
 
-def entry():
-    token_dict_dump_dir = "token_dict.json"
-
-    m_sentences = get_lines_with_auto_encoding_mode("corpus_cleaned_metadata.txt")
-    m_unigram = get_parallel_data(list(set(s.strip() for s in m_sentences if len(s.strip()) >= 4)))
-
-    n_sentences = get_lines_with_auto_encoding_mode("corpus_cleaned_novels.txt")
-    n_unigram = get_parallel_data(list(set(s.strip() for s in n_sentences if len(s.strip()) >= 4)))
-
-    t_sentences = get_lines_with_auto_encoding_mode("corpus_cleaned_thu.txt")
-    t_unigram = get_parallel_data(list(set(s.strip() for s in t_sentences if len(s.strip()) >= 2)))
-
+def wrap_candidate_index(token_dict, top_k=None):
+    candidate_index = {}
+    for shared_key, tokens in token_dict.items():
+        candidates = sorted(tokens, key=lambda token: tokens[token], reverse=True)
+        candidate_index[shared_key] = candidates[:top_k] if top_k else candidates
+    return candidate_index
+
+def load_source_unigrams(counts_path=unigram_counts_path):
+    if not os.path.exists(counts_path):
+        raise FileNotFoundError(f"{counts_path} not found; run a full entry() first")
+    with open(counts_path, "r", encoding="utf-8") as r:
+        return json.load(r)
+
+def save_source_unigrams(source_unigrams, counts_path=unigram_counts_path):
+    with open(counts_path + ".tmp", "w", encoding="utf-8") as w:
+        json.dump(source_unigrams, w, ensure_ascii=False)
+    os.replace(counts_path + ".tmp", counts_path)
+
+def build_lexicon(source_unigrams, lexicon_dump_dir):
+    m_unigram = source_unigrams.get("metadata", {})
     m_total = sum(m_unigram.values()) if m_unigram else 1
-    unigram_dict = m_unigram
+    # Each source keeps its tokens in order of first appearance, and a delta appends the
+    # tokens it adds, so frequency ties break by the first line a token appeared on.
+    unigram_dict = dict(m_unigram)
 
-    for other_uni, weight in [(n_unigram, 0.1), (t_unigram, 0.25)]:
+    for source, weight in lexicon_source_weights:
+        other_uni = source_unigrams.get(source, {})
         other_total = sum(other_uni.values())
         if other_total > 0:
             factor = (m_total / other_total) * weight
@@ -99,16 +108,38 @@ def entry():
 
     final_token_dict = wrap_token_dict(unigram_dict)
 
-    with open(token_dict_dump_dir, "w", encoding="utf-8") as w:
-        json.dump(final_token_dict, w, ensure_ascii=False)
+    build_lexicon_store(final_token_dict, lexicon_dump_dir)
+
+def entry():
+    lexicon_dump_dir = "lexicon.bin"
+
+    source_unigrams = {source: get_streaming_data(filepath, min_length) for source, filepath, min_length in lexicon_sources}
+    save_source_unigrams(source_unigrams)
+    build_lexicon(source_unigrams, lexicon_dump_dir)
+
+def delta_entry(filepath, source, lexicon_dump_dir="lexicon.bin"):
+    source_unigrams = load_source_unigrams()
+    min_length = {name: min_length for name, _, min_length in lexicon_sources}[source]
+    unigram = source_unigrams.setdefault(source, {})
+    for token, count in get_streaming_data(filepath, min_length).items():
+        unigram[token] = unigram.get(token, 0) + count
+    save_source_unigrams(source_unigrams)
+    build_lexicon(source_unigrams, lexicon_dump_dir)
 
 def check():
-    if os.path.exists("token_dict.json"):
-        with open("token_dict.json", "r", encoding="utf-8") as r:
-            target = json.load(r)
-            vocab_size = sum(len(sub) for sub in target.values())
-            print(f"vocab size is equal to {vocab_size}")
+    if os.path.exists("lexicon.bin"):
+        target = LexiconStore("lexicon.bin")
+        print(f"vocab size is equal to {target.n_entries}")
+        target.close()
 
 if __name__ == '__main__':
-    entry()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--delta", default=None)
+    parser.add_argument("--source", choices=[source for source, _, _ in lexicon_sources], default="metadata")
+    args = parser.parse_args()
+
+    if args.delta:
+        delta_entry(args.delta, args.source)
+    else:
+        entry()
     check()
\ No newline at end of file
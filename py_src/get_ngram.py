@@ -1,102 +1,194 @@
 import os
-import warnings
-warnings.filterwarnings("ignore", category=UserWarning, module="jieba")
-
-import jieba
-import logging
 import sqlite3
 import tempfile
 import shutil
+import heapq
+import argparse
+from collections import Counter
 from tqdm import tqdm
-from constant import N
+from constant import N, ngram_min_count_per_order, ngram_spill_threshold, ngram_merge_fanin, stream_batch_size, stream_max_pending, \
+    ngram_counts_path
+from corpus_stream import iter_batches, bounded_imap_unordered
+from tokenized_corpus import tokenize_corpus, build_shared_vocab, iter_shared_token_ids
+from ngram_store import ID_BITS, build_ngram_store, write_log_probs
 from multiprocessing import Pool, cpu_count
-jieba.setLogLevel(logging.ERROR)
+
+corpus_files = ["corpus_cleaned_metadata.txt", "corpus_cleaned_novels.txt", "corpus_cleaned_thu.txt"]
 
 def create_schema(cursor):
-    cursor.execute('CREATE TABLE IF NOT EXISTS ngrams (order_n INTEGER NOT NULL, gram TEXT NOT NULL, count INTEGER DEFAULT 1, PRIMARY KEY (order_n, gram)) WITHOUT ROWID')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_order_gram ON ngrams(order_n, gram)')
+    cursor.execute('CREATE TABLE IF NOT EXISTS ngrams (order_n INTEGER NOT NULL, gram INTEGER NOT NULL, count INTEGER DEFAULT 1, log_prob REAL, PRIMARY KEY (order_n, gram)) WITHOUT ROWID')
+    cursor.execute('CREATE TABLE IF NOT EXISTS vocab (id INTEGER PRIMARY KEY, token TEXT NOT NULL)')
+
+def write_vocab(cursor, vocab):
+    cursor.executemany('INSERT INTO vocab (id, token) VALUES (?, ?)', ((token_id, token) for token, token_id in vocab.items()))
+
+def get_min_count(order):
+    return ngram_min_count_per_order[min(order, len(ngram_min_count_per_order)) - 1]
+
+def write_sorted_run(counter, temp_dir):
+    fd, run_path = tempfile.mkstemp(suffix=".run", dir=temp_dir)
+    with os.fdopen(fd, "w", encoding="utf-8") as w:
+        for (order, gram), count in sorted(counter.items()):
+            w.write(f"{order}\t{gram}\t{count}\n")
+    return run_path
+
+def read_sorted_run(run_path):
+    with open(run_path, "r", encoding="utf-8") as r:
+        for line in r:
+            order, gram, count = line.split("\t")
+            yield int(order), int(gram), int(count)
 
-def process_chunk_to_db(lines_chunk):
+def process_chunk_to_runs(ids_chunk):
     temp_dir = tempfile.mkdtemp()
-    db_path = os.path.join(temp_dir, 'part.db')
     try:
-        conn = sqlite3.connect(db_path)
-        cur = conn.cursor()
-        create_schema(cur)
-        for line in lines_chunk:
-            line = line.strip()
-            if not line: continue
-            tokens = jieba.lcut(line)
-            L = len(tokens)
+        run_paths = []
+        counter = Counter()
+        for ids in ids_chunk:
+            L = len(ids)
             for i in range(L):
-                for o in range(1, N + 1):
-                    if i + o <= L:
-                        k = "".join(tokens[i:i + o])
-                        cur.execute('INSERT OR IGNORE INTO ngrams (order_n, gram, count) VALUES (?, ?, 0)', (o, k))
-                        cur.execute('UPDATE ngrams SET count = count + 1 WHERE order_n = ? AND gram = ?', (o, k))
-        conn.commit()
-        conn.close()
-        return db_path
-    except Exception as e:
-        print(f"Error: {e}")
-        if os.path.exists(db_path):
-            os.remove(db_path)
+                key = 0
+                for o in range(1, min(N, L - i) + 1):
+                    key = key << ID_BITS | ids[i + o - 1]
+                    counter[o, key] += 1
+            if len(counter) >= ngram_spill_threshold:
+                run_paths.append(write_sorted_run(counter, temp_dir))
+                counter.clear()
+        if counter:
+            run_paths.append(write_sorted_run(counter, temp_dir))
+        return run_paths
+    except BaseException:
         shutil.rmtree(temp_dir, ignore_errors=True)
-        return None
-
-def merge_databases(output_db, db_paths):
-    if os.path.exists(output_db):
-        os.remove(output_db)
-    conn_out = sqlite3.connect(output_db)
-    cur_out = conn_out.cursor()
-    create_schema(cur_out)
-    conn_out.close()
-    for db_path in tqdm(db_paths, "Merging Databases"):
-        if not db_path or not os.path.exists(db_path):
-            continue
-        try:
-            conn_src = sqlite3.connect(db_path)
-            cur_src = conn_src.cursor()
-            conn_dest = sqlite3.connect(output_db)
-            cur_dest = conn_dest.cursor()
-            cur_src.execute("SELECT order_n, gram, count FROM ngrams")
-            rows = cur_src.fetchall()
-            if rows:
-                cur_dest.executemany('INSERT OR IGNORE INTO ngrams (order_n, gram, count) VALUES (?, ?, 0)', [(r[0], r[1]) for r in rows])
-                cur_dest.executemany('UPDATE ngrams SET count = count + ? WHERE order_n = ? AND gram = ?', [(r[2], r[0], r[1]) for r in rows])
-                conn_dest.commit()
-            conn_src.close()
-            conn_dest.close()
-            os.remove(db_path)
-            shutil.rmtree(os.path.dirname(db_path), ignore_errors=True)
-        except Exception as e:
-            print(f"Merge error: {e}")
-            try:
-                if 'conn_src' in locals(): conn_src.close()
-                if 'conn_dest' in locals(): conn_dest.close()
-            except: pass
-    conn_final = sqlite3.connect(output_db)
-    cur_final = conn_final.cursor()
-    cur_final.execute('DELETE FROM ngrams WHERE order_n > 1 AND count <= 1')
-    conn_final.commit()
-    conn_final.close()
+        raise
+
+def merge_sorted_runs(run_paths, extra_runs=()):
+    current_key, current_count = None, 0
+    for order, gram, count in heapq.merge(*[read_sorted_run(p) for p in run_paths], *extra_runs):
+        if (order, gram) != current_key:
+            if current_key is not None:
+                yield current_key[0], current_key[1], current_count
+            current_key, current_count = (order, gram), 0
+        current_count += count
+    if current_key is not None:
+        yield current_key[0], current_key[1], current_count
+
+def compact_runs(run_paths):
+    while len(run_paths) > ngram_merge_fanin:
+        temp_dir = tempfile.mkdtemp()
+        compacted = []
+        for i in range(0, len(run_paths), ngram_merge_fanin):
+            group = run_paths[i:i + ngram_merge_fanin]
+            fd, run_path = tempfile.mkstemp(suffix=".run", dir=temp_dir)
+            with os.fdopen(fd, "w", encoding="utf-8") as w:
+                for order, gram, count in merge_sorted_runs(group):
+                    w.write(f"{order}\t{gram}\t{count}\n")
+            remove_runs(group)
+            compacted.append(run_path)
+        run_paths = compacted
+    return run_paths
+
+def remove_runs(run_paths):
+    for run_path in run_paths:
+        os.remove(run_path)
+    for temp_dir in set(os.path.dirname(p) for p in run_paths):
+        if not os.listdir(temp_dir):
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+def tee_counts(rows, w):
+    for order, gram, count in rows:
+        w.write(f"{order}\t{gram}\t{count}\n")
+        yield order, gram, count
+
+def merge_runs(output_db, run_paths, vocab, extra_runs=(), counts_path=None):
+    # The database is built beside output_db and swapped in whole, so a running server
+    # never sees a half-written model. counts_path keeps the unpruned counts for delta_entry.
+    run_paths = compact_runs(run_paths)
+    tmp_db = output_db + ".tmp"
+    if os.path.exists(tmp_db):
+        os.remove(tmp_db)
+    conn = sqlite3.connect(tmp_db)
+    cur = conn.cursor()
+    create_schema(cur)
+    write_vocab(cur, vocab)
+    merged = merge_sorted_runs(run_paths, extra_runs)
+    with open(counts_path + ".tmp", "w", encoding="utf-8") if counts_path else open(os.devnull, "w") as w:
+        rows = ((order, gram, count) for order, gram, count in tee_counts(merged, w) if count >= get_min_count(order))
+        cur.executemany('INSERT INTO ngrams (order_n, gram, count) VALUES (?, ?, ?)', tqdm(rows, "Merging Runs"))
+    write_log_probs(conn)
+    conn.close()
+    if counts_path:
+        os.replace(counts_path + ".tmp", counts_path)
+    os.replace(tmp_db, output_db)
+    remove_runs(run_paths)
+
+def count_runs(chunks):
+    run_paths = []
+    try:
+        with Pool(processes=cpu_count()) as pool:
+            for res in tqdm(bounded_imap_unordered(pool, process_chunk_to_runs, chunks, stream_max_pending), desc="Processing Chunks"):
+                run_paths.extend(res)
+    except BaseException:
+        # A failed chunk must fail the build; the runs of the chunks that finished are dropped.
+        remove_runs(run_paths)
+        raise
+    return run_paths
+
+def check_vocab_size(vocab):
+    if len(vocab) >= 1 << ID_BITS:
+        raise ValueError(f"vocabulary of {len(vocab)} tokens does not fit in {ID_BITS}-bit token ids")
 
 def train_entry():
-    target_files = ["corpus_cleaned_metadata.txt", "corpus_cleaned_novels.txt", "corpus_cleaned_thu.txt"]
-    all_lines = []
-    for f in target_files:
-        if os.path.exists(f):
-            with open(f, 'r', encoding='utf-8') as rf:
-                all_lines.extend(rf.readlines())
-    n_chunks = cpu_count() * 2
-    chunk_size = max(1, len(all_lines) // n_chunks)
-    chunks = [all_lines[i:i + chunk_size] for i in range(0, len(all_lines), chunk_size)]
-    db_paths = []
-    with Pool(processes=min(cpu_count(), len(chunks))) as pool:
-        for res in tqdm(pool.imap_unordered(process_chunk_to_db, chunks), total=len(chunks), desc="Processing Chunks"):
-            if res:
-                db_paths.append(res)
-    merge_databases("ngram.db", db_paths)
+    # The vocab is checked after each corpus so an oversized one fails before the rest
+    # are tokenized.
+    corpus_dirs, remaps, vocab = [], [], {}
+    for corpus_file in corpus_files:
+        corpus_dir = tokenize_corpus(corpus_file)
+        if corpus_dir is None:
+            continue
+        vocab, (remap,) = build_shared_vocab([corpus_dir], vocab)
+        check_vocab_size(vocab)
+        corpus_dirs.append(corpus_dir)
+        remaps.append(remap)
+    lines = (ids for d, remap in zip(corpus_dirs, remaps) for ids in iter_shared_token_ids(d, remap))
+    run_paths = count_runs(iter_batches(lines, stream_batch_size))
+    merge_runs("ngram.db", run_paths, vocab, counts_path=ngram_counts_path)
+    build_ngram_store("ngram.db", "ngram.bin")
+
+def load_model_vocab(db_path):
+    conn = sqlite3.connect(db_path)
+    vocab = {token: token_id for token_id, token in conn.execute("SELECT id, token FROM vocab ORDER BY id")}
+    conn.close()
+    return vocab
+
+def iter_db_counts(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        yield from conn.execute("SELECT order_n, gram, count FROM ngrams ORDER BY order_n, gram")
+    finally:
+        conn.close()
+
+def delta_entry(corpus_path, db_path="ngram.db", store_path="ngram.bin", counts_path=ngram_counts_path):
+    # Counts only the new corpus and merges it into the counts of the last build.
+    corpus_dir = tokenize_corpus(corpus_path)
+    if corpus_dir is None:
+        raise FileNotFoundError(corpus_path)
+    vocab, remaps = build_shared_vocab([corpus_dir], load_model_vocab(db_path))
+    check_vocab_size(vocab)
+    run_paths = count_runs(iter_batches(iter_shared_token_ids(corpus_dir, remaps[0]), stream_batch_size))
+    if os.path.exists(counts_path):
+        base_counts = read_sorted_run(counts_path)
+    else:
+        # Grams the min-count filter dropped from the database start again from zero.
+        print(f"{counts_path} not found, merging into the pruned counts of {db_path}")
+        base_counts = iter_db_counts(db_path)
+    merge_runs(db_path, run_paths, vocab, [base_counts], counts_path)
+    build_ngram_store(db_path, store_path)
 
 if __name__ == '__main__':
-    train_entry()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--delta", default=None)
+    args = parser.parse_args()
+
+    if args.delta:
+        delta_entry(args.delta)
+    else:
+        train_entry()
\ No newline at end of file
@@ -1,15 +1,23 @@
 import os
 import re
+import shutil
+import tempfile
 from tqdm import tqdm
-from constant import encodings
+from multiprocessing import Pool, cpu_count
+from constant import clean_chunk_size
+from corpus_stream import load_encoding_cache, save_encoding_cache, get_cached_encoding
+
+sentence_separator = re.compile(r'[。！？，、；：：“”‘’（）《》\s\-\.]')
 
 def process_metadata_csv(csv_path, output_file):
-    pattern = re.compile(r'[\u4e00-\u9fa5]+')
+    pattern = get_chinese_pattern()
     if not os.path.exists(csv_path):
         return
-    with open(csv_path, 'r', encoding='utf-8') as f, open(output_file, 'w', encoding='utf-8') as out_f:
-        lines_from_file = f.readlines()
-        for line in tqdm(lines_from_file, desc="Processing metadata"):
+    cache = load_encoding_cache()
+    encoding = get_cached_encoding(csv_path, cache)
+    save_encoding_cache(cache)
+    with open(csv_path, 'r', encoding=encoding, errors='replace') as f, open(output_file, 'w', encoding='utf-8') as out_f:
+        for line in tqdm(f, desc="Processing metadata"):
             parts = line.strip().split('\t')
             if len(parts) < 2:
                 continue
@@ -18,57 +26,83 @@ def process_metadata_csv(csv_path, output_file):
             if len(clean_sent) >= 5:
                 out_f.write(clean_sent + '\n')
 
-def get_valid_file_cursor(filepath):
-    for encoding in encodings:
-        try:
-            f = open(filepath, 'r', encoding=encoding)
-            f.readline()
-            f.seek(0)
-            return f
-        except:
-            continue
-    raise RuntimeError("cannot find valid file cursor")
+def get_valid_file_cursor(filepath, encoding=None):
+    # Bytes that do not decode are replaced rather than ending the run.
+    if encoding is None:
+        cache = load_encoding_cache()
+        encoding = get_cached_encoding(filepath, cache)
+        save_encoding_cache(cache)
+    return open(filepath, 'r', encoding=encoding, errors='replace')
 
 def get_chinese_pattern():
     return re.compile(r'[\u4e00-\u9fa5]+')
 
-def process_thu_dict(dict_dir, output_file):
+def iter_sentences(f, chunk_size=clean_chunk_size):
+    # The piece after a chunk's last separator may continue in the next chunk, so it is carried over.
+    carry = ""
+    for chunk in iter(lambda: f.read(chunk_size), ""):
+        sentences = sentence_separator.split(carry + chunk)
+        carry = sentences.pop()
+        yield from sentences
+    yield carry
+
+def clean_novel_file(task):
+    file_path, encoding, shard_path = task
     pattern = get_chinese_pattern()
-    file_list = [os.path.join(root, f) for root, _, files in os.walk(dict_dir) for f in files if f.endswith('.txt')]
-
-    with open(output_file, 'w', encoding='utf-8') as out_f:
-        for file_path in tqdm(file_list, desc="Processing THU Dict"):
-            f = get_valid_file_cursor(file_path)
-            for line in f:
-                parts = line.strip().split('\t')
-                if parts:
-                    word = "".join(pattern.findall(parts[0]))
-                    if len(word) >= 2:
-                        out_f.write(word + '\n')
-            f.close()
-
-def generate_cleaned_corpus(novels_root_dir, output_file):
+    n_lines = 0
+    with get_valid_file_cursor(file_path, encoding) as f, open(shard_path, 'w', encoding='utf-8') as out_f:
+        for sent in iter_sentences(f):
+            clean_sent = "".join(pattern.findall(sent))
+            if len(clean_sent) >= 5:
+                out_f.write(clean_sent + '\n')
+                n_lines += 1
+    return n_lines
+
+def clean_dict_file(task):
+    file_path, encoding, shard_path = task
     pattern = get_chinese_pattern()
-    file_list = [
-        os.path.join(root, f) for root, _, files in os.walk(novels_root_dir)
-        for f in files if f.endswith('.txt')
-    ]
+    n_lines = 0
+    with get_valid_file_cursor(file_path, encoding) as f, open(shard_path, 'w', encoding='utf-8') as out_f:
+        for line in f:
+            parts = line.strip().split('\t')
+            if parts:
+                word = "".join(pattern.findall(parts[0]))
+                if len(word) >= 2:
+                    out_f.write(word + '\n')
+                    n_lines += 1
+    return n_lines
+
+def list_txt_files(root_dir):
+    return [os.path.join(root, f) for root, _, files in os.walk(root_dir) for f in sorted(files) if f.endswith('.txt')]
+
+def clean_files(file_list, clean_file, output_file, desc, processes=None):
+    # Each file is cleaned into its own shard; shards are concatenated in file order,
+    # so the output does not depend on which worker finished first.
+    cache = load_encoding_cache()
+    encodings = [get_cached_encoding(file_path, cache) for file_path in file_list]
+    save_encoding_cache(cache)
 
-    with open(output_file, 'w', encoding='utf-8') as out_f:
-        for file_path in tqdm(file_list, desc="Cleaning Novels"):
-            f = get_valid_file_cursor(file_path)
-            content = f.read()
+    shard_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output_file)))
+    try:
+        shard_paths = [os.path.join(shard_dir, f"{i}.txt") for i in range(len(file_list))]
+        tasks = sorted(zip(file_list, encodings, shard_paths), key=lambda task: os.path.getsize(task[0]), reverse=True)
+        with Pool(processes or cpu_count()) as pool:
+            for _ in tqdm(pool.imap_unordered(clean_file, tasks), total=len(tasks), desc=desc):
+                pass
 
-            if content:
-                content = re.sub(r'\s+', ' ', content)
-                sentences = re.split(r'[。！？，、；：：“”‘’（）《》\s\-\.]', content)
+        with open(output_file + ".tmp", 'wb') as out_f:
+            for shard_path in shard_paths:
+                with open(shard_path, 'rb') as r:
+                    shutil.copyfileobj(r, out_f)
+        os.replace(output_file + ".tmp", output_file)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
 
-                for sent in sentences:
-                    clean_sent = "".join(pattern.findall(sent))
-                    if len(clean_sent) >= 5:
-                        out_f.write(clean_sent + '\n')
+def process_thu_dict(dict_dir, output_file, processes=None):
+    clean_files(list_txt_files(dict_dir), clean_dict_file, output_file, "Processing THU Dict", processes)
 
-            f.close()
+def generate_cleaned_corpus(novels_root_dir, output_file, processes=None):
+    clean_files(list_txt_files(novels_root_dir), clean_novel_file, output_file, "Cleaning Novels", processes)
 
 if __name__ == "__main__":
     novels_root_path = r'novels'
@@ -81,4 +115,4 @@ if __name__ == "__main__":
 
     generate_cleaned_corpus(novels_root_path, novels_output)
     process_metadata_csv(metadata_csv, metadata_output)
-    process_thu_dict(thu_dict_path, thu_dict_output)
\ No newline at end of file
+    process_thu_dict(thu_dict_path, thu_dict_output)
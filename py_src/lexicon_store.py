@@ -0,0 +1,171 @@
+import os
+import json
+import mmap
+import struct
+from array import array
+from collections.abc import Mapping
+from ngram_store import get_capacity, string_hash
+
+LEXICON_MAGIC = b"LEXSTORE"
+LEXICON_VERSION = 2
+HEADER_FORMAT = "<8sIIQQQ"
+HEADER_SIZE = 64
+
+def pack_lexicon(token_dict):
+    blob = bytearray()
+    offsets = {}
+
+    def intern(s):
+        if s not in offsets:
+            offsets[s] = len(blob)
+            blob.extend(s.encode("utf-8"))
+        return offsets[s], len(s.encode("utf-8"))
+
+    keys = sorted(token_dict)
+    capacity = get_capacity(len(keys))
+    mask = capacity - 1
+    slot_hashes = array("Q", bytes(8 * capacity))
+    slot_keys = array("I", bytes(4 * capacity))
+    key_table = array("I")
+    token_offsets = array("I")
+    token_lengths = array("I")
+    freqs = array("I")
+
+    for key_id, key in enumerate(keys):
+        h = string_hash(key)
+        slot = h & mask
+        while slot_hashes[slot]:
+            slot = (slot + 1) & mask
+        slot_hashes[slot] = h
+        slot_keys[slot] = key_id + 1
+
+        tokens = token_dict[key]
+        key_offset, key_length = intern(key)
+        key_table.extend((key_offset, key_length, len(freqs), len(tokens)))
+        for token in sorted(tokens, key=lambda t: tokens[t], reverse=True):
+            token_offset, token_length = intern(token)
+            token_offsets.append(token_offset)
+            token_lengths.append(token_length)
+            freqs.append(min(tokens[token], 0xFFFFFFFF))
+
+    header = struct.pack(HEADER_FORMAT, LEXICON_MAGIC, LEXICON_VERSION, capacity, len(keys), len(freqs), len(blob))
+    return b"".join([header.ljust(HEADER_SIZE, b"\0"), slot_hashes.tobytes(), slot_keys.tobytes(), key_table.tobytes(),
+                     token_offsets.tobytes(), token_lengths.tobytes(), freqs.tobytes(), bytes(blob)])
+
+def build_lexicon_store(token_dict, store_path):
+    tmp_path = store_path + ".tmp"
+    with open(tmp_path, "wb") as w:
+        w.write(pack_lexicon(token_dict))
+    os.replace(tmp_path, store_path)
+
+def convert_json_lexicon(json_path, store_path):
+    with open(json_path, "r", encoding="utf-8") as r:
+        build_lexicon_store(json.load(r), store_path)
+
+def is_lexicon_store(path):
+    if not os.path.isfile(path):
+        return False
+    with open(path, "rb") as r:
+        return r.read(len(LEXICON_MAGIC)) == LEXICON_MAGIC
+
+def get_default_lexicon_path(base_dir=""):
+    # lexicon.bin when it has been built, otherwise the token_dict.json it replaced.
+    path = os.path.join(base_dir, "lexicon.bin")
+    return path if os.path.exists(path) else os.path.join(base_dir, "token_dict.json")
+
+def load_lexicon(path, top_k=None):
+    if is_lexicon_store(path):
+        return LexiconStore(path, top_k=top_k)
+    with open(path, "r", encoding="utf-8") as r:
+        return json.load(r)
+
+class LexiconStore(Mapping):
+    def __init__(self, store_path=None, buffer=None, top_k=None):
+        self.mm = None
+        if buffer is None:
+            with open(store_path, "rb") as r:
+                self.mm = mmap.mmap(r.fileno(), 0, access=mmap.ACCESS_READ)
+            buffer = self.mm
+        view = memoryview(buffer)
+
+        magic, version, self.capacity, self.n_keys, self.n_entries, blob_size = struct.unpack_from(HEADER_FORMAT, view, 0)
+        if magic != LEXICON_MAGIC or version != LEXICON_VERSION:
+            raise ValueError(f"not a version {LEXICON_VERSION} lexicon store")
+
+        self.mask = self.capacity - 1
+        self.top_k = top_k
+        sections = []
+        pos = HEADER_SIZE
+        for typecode, length in [("Q", self.capacity), ("I", self.capacity), ("I", 4 * self.n_keys),
+                                 ("I", self.n_entries), ("I", self.n_entries), ("I", self.n_entries)]:
+            size = array(typecode).itemsize * length
+            sections.append(view[pos:pos + size].cast(typecode))
+            pos += size
+        self.slot_hashes, self.slot_keys, self.key_table, self.token_offsets, self.token_lengths, self.freqs = sections
+        self.blob = view[pos:pos + blob_size]
+
+    def get_string(self, offset, length):
+        return str(self.blob[offset:offset + length], "utf-8")
+
+    def find_key(self, key):
+        h = string_hash(key)
+        slot_hashes = self.slot_hashes
+        mask = self.mask
+        slot = h & mask
+        while True:
+            k = slot_hashes[slot]
+            if not k:
+                return -1
+            if k == h:
+                key_id = self.slot_keys[slot] - 1
+                if self.get_key(key_id) == key:
+                    return key_id
+            slot = (slot + 1) & mask
+
+    def get_key(self, key_id):
+        return self.get_string(self.key_table[4 * key_id], self.key_table[4 * key_id + 1])
+
+    def get_entries(self, key_id):
+        start, count = self.key_table[4 * key_id + 2], self.key_table[4 * key_id + 3]
+        return {self.get_string(self.token_offsets[i], self.token_lengths[i]): self.freqs[i]
+                for i in range(start, start + count)}
+
+    def __getitem__(self, key):
+        key_id = self.find_key(key)
+        if key_id < 0:
+            raise KeyError(key)
+        return self.get_entries(key_id)
+
+    def __contains__(self, key):
+        return isinstance(key, str) and self.find_key(key) >= 0
+
+    def __iter__(self):
+        return (self.get_key(key_id) for key_id in range(self.n_keys))
+
+    def __len__(self):
+        return self.n_keys
+
+    def get_candidates(self, key, default=None):
+        key_id = self.find_key(key)
+        if key_id < 0:
+            return [] if default is None else default
+        start, count = self.key_table[4 * key_id + 2], self.key_table[4 * key_id + 3]
+        if self.top_k:
+            count = min(count, self.top_k)
+        return [self.get_string(self.token_offsets[i], self.token_lengths[i]) for i in range(start, start + count)]
+
+    def close(self):
+        for view in (self.slot_hashes, self.slot_keys, self.key_table, self.token_offsets, self.token_lengths, self.freqs, self.blob):
+            view.release()
+        if self.mm is not None:
+            self.mm.close()
+
+class CandidateView:
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, key, default=None):
+        return self.store.get_candidates(key, default)
+
+if __name__ == '__main__':
+    convert_json_lexicon("token_dict.json", "lexicon.bin")
@@ -0,0 +1,65 @@
+import threading
+from collections import OrderedDict
+from stats import stats
+
+MISSING = object()
+
+class LRUCache:
+    def __init__(self, max_entries=None, name=None):
+        self.max_entries = max_entries
+        self.name = name
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=MISSING):
+        with self.lock:
+            value = self.entries.get(key, MISSING)
+            if value is MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+        if stats.enabled and self.name:
+            stats.incr(f"{self.name}.misses" if value is MISSING else f"{self.name}.hits")
+        return default if value is MISSING else value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if self.max_entries is not None:
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return value
+
+    def setdefault(self, key, value):
+        with self.lock:
+            value = self.entries.setdefault(key, value)
+            self.entries.move_to_end(key)
+            if self.max_entries is not None:
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return value
+
+    def pop(self, key, default=None):
+        with self.lock:
+            return self.entries.pop(key, default)
+
+    def items(self):
+        with self.lock:
+            return list(self.entries.items())
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def info(self):
+        lookups = self.hits + self.misses
+        return {"entries": len(self.entries), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
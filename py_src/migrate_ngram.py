@@ -0,0 +1,72 @@
+import os
+import math
+import sqlite3
+import argparse
+from tqdm import tqdm
+from get_ngram import create_schema, write_vocab
+from ngram_store import pack_ids, is_legacy_db, write_log_probs, ensure_log_probs
+
+def split_gram(gram, order, unigrams):
+    # Old tables stored the concatenated text only, so pick the split into
+    # known tokens with the highest unigram likelihood.
+    best = None
+    if order == 1:
+        return [gram] if gram in unigrams else None
+    for j in range(1, len(gram)):
+        head = gram[:j]
+        if head not in unigrams:
+            continue
+        rest = split_gram(gram[j:], order - 1, unigrams)
+        if rest is None:
+            continue
+        score = math.log(unigrams[head]) + sum(math.log(unigrams[token]) for token in rest)
+        if best is None or score > best[0]:
+            best = (score, [head] + rest)
+    return best[1] if best else None
+
+def migrate_ngram_db(old_db, new_db):
+    old_conn = sqlite3.connect(old_db)
+    unigrams = dict(old_conn.execute("SELECT gram, count FROM ngrams WHERE order_n=1 ORDER BY count DESC, gram"))
+    vocab = {token: token_id for token_id, token in enumerate(unigrams, 1)}
+
+    tmp_path = new_db + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    cur = conn.cursor()
+    create_schema(cur)
+    write_vocab(cur, vocab)
+
+    migrated = dropped = 0
+    merged = {}
+    for order, gram, count in tqdm(old_conn.execute("SELECT order_n, gram, count FROM ngrams"), desc="Migrating"):
+        tokens = split_gram(gram, order, unigrams)
+        if tokens is None:
+            dropped += 1
+            continue
+        key = (order, pack_ids([vocab[token] for token in tokens]))
+        merged[key] = merged.get(key, 0) + count
+        migrated += 1
+    old_conn.close()
+
+    cur.executemany('INSERT INTO ngrams (order_n, gram, count) VALUES (?, ?, ?)',
+                    ((order, key, count) for (order, key), count in merged.items()))
+    write_log_probs(conn)
+    conn.close()
+    os.replace(tmp_path, new_db)
+    return migrated, dropped
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", default="ngram.db")
+    parser.add_argument("--output", default="ngram.db")
+    args = parser.parse_args()
+
+    if not is_legacy_db(args.input):
+        if ensure_log_probs(args.input):
+            print(f"{args.input} already uses token ids; recomputed its log-probs")
+        else:
+            print(f"{args.input} already uses token ids")
+    else:
+        migrated, dropped = migrate_ngram_db(args.input, args.output)
+        print(f"migrated {migrated} grams, dropped {dropped} without a split into known tokens")
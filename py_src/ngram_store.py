@@ -0,0 +1,386 @@
+import os
+import mmap
+import struct
+import sqlite3
+import math
+import hashlib
+from pathlib import Path
+from array import array
+from bisect import bisect_left
+from constant import N, alpha
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+STORE_MAGIC = b"NGRAMST\0"
+STORE_VERSION = 5
+HEADER_FORMAT = "<8sIIQQQQIIQdIII"
+HEADER_SIZE = 128
+MAX_LOAD_FACTOR = 0.6
+COUNT_TYPECODES = {8: "B", 16: "H", 32: "I"}
+LOG_PROB_TYPECODES = {8: "B", 16: "H", 64: "d"}
+ID_BITS = 63 // N
+KEY_MULTIPLIER = 0x9E3779B97F4A7C15
+
+def pack_ids(ids):
+    key = 0
+    for token_id in ids:
+        key = key << ID_BITS | token_id
+    return key
+
+def unpack_key(key, order):
+    mask = (1 << ID_BITS) - 1
+    return [(key >> (ID_BITS * (order - 1 - j))) & mask for j in range(order)]
+
+def key_hash(key):
+    return (key * KEY_MULTIPLIER & 0xFFFFFFFFFFFFFFFF) >> 32
+
+def string_hash(s):
+    digest = hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") or 1
+
+def get_gram_log_prob(order, count, prev_count, total_unigram_count, vocab_size, n_order=N):
+    if order == 1:
+        prob = (count + alpha) / (total_unigram_count + alpha * vocab_size)
+    else:
+        prob = (count + alpha) / (prev_count + alpha * vocab_size)
+    if order < n_order:
+        prob *= (0.01 ** (n_order - order))
+    return math.log10(prob)
+
+def get_unmatched_log_prob(total_unigram_count, vocab_size, n_order=N):
+    prob = alpha / (total_unigram_count + alpha * vocab_size)
+    prob *= (0.1 ** n_order)
+    return math.log10(prob)
+
+def get_capacity(n_entries):
+    capacity = 16
+    while capacity * MAX_LOAD_FACTOR < n_entries:
+        capacity *= 2
+    return capacity
+
+def get_count_codebook(counts, count_bits):
+    # Small counts matter most to the smoothed probabilities, so keep them exact
+    # and spread the remaining levels geometrically up to the largest count.
+    n_levels = 1 << count_bits
+    distinct = sorted(set(counts))
+    if len(distinct) <= n_levels:
+        return distinct
+    n_exact = n_levels // 2
+    levels = distinct[:n_exact]
+    low, high = math.log(levels[-1]), math.log(distinct[-1])
+    n_geometric = n_levels - n_exact
+    for j in range(1, n_geometric + 1):
+        level = round(math.exp(low + (high - low) * j / n_geometric))
+        if level > levels[-1]:
+            levels.append(level)
+    return levels
+
+def quantize_count(codebook, count):
+    j = bisect_left(codebook, count)
+    if j == len(codebook):
+        return j - 1
+    if j and math.log(count) - math.log(codebook[j - 1]) < math.log(codebook[j]) - math.log(count):
+        return j - 1
+    return j
+
+def get_log_prob_codebook(log_probs, log_prob_bits, iterations=20):
+    # Start from equal-population bins, then move each level to the mean of the values
+    # nearest to it (1-D Lloyd), so sparse tails are not left inside one wide bin.
+    n_levels = 1 << log_prob_bits
+    values = sorted(log_probs)
+    distinct = sorted(set(values))
+    if len(distinct) <= n_levels:
+        return distinct
+    prefix = [0.0]
+    for value in values:
+        prefix.append(prefix[-1] + value)
+    bounds = [len(values) * j // n_levels for j in range(n_levels + 1)]
+    for _ in range(iterations + 1):
+        levels = [(prefix[end] - prefix[begin]) / (end - begin) for begin, end in zip(bounds, bounds[1:]) if end > begin]
+        bounds = [0] + [bisect_left(values, (a + b) / 2) for a, b in zip(levels, levels[1:])] + [len(values)]
+    return sorted(set(levels))
+
+def quantize_log_prob(codebook, log_prob):
+    j = bisect_left(codebook, log_prob)
+    if j == len(codebook):
+        return j - 1
+    if j and log_prob - codebook[j - 1] < codebook[j] - log_prob:
+        return j - 1
+    return j
+
+def is_ngram_store(path):
+    if not os.path.isfile(path):
+        return False
+    with open(path, "rb") as r:
+        return r.read(len(STORE_MAGIC)) == STORE_MAGIC
+
+def connect_read_only(db_path, **kwargs):
+    return sqlite3.connect(Path(db_path).absolute().as_uri() + "?mode=ro", uri=True, **kwargs)
+
+def is_legacy_db(db_path):
+    conn = connect_read_only(db_path)
+    has_vocab = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='vocab'").fetchone()
+    conn.close()
+    return not has_vocab
+
+def has_fresh_log_probs(conn):
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='meta'").fetchone():
+        return False
+    meta = dict(conn.execute("SELECT key, value FROM meta"))
+    if meta.get("N") != str(N):
+        raise ValueError(f"model was trained with N={meta.get('N')}, constant.N is {N}; retrain it")
+    return meta.get("alpha") == repr(alpha)
+
+def write_log_probs(conn):
+    # Bake alpha smoothing and the backoff penalty into every gram so the scorer
+    # needs one lookup per token instead of a gram and a history lookup.
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(ngrams)")]
+    if "log_prob" not in columns:
+        conn.execute("ALTER TABLE ngrams ADD COLUMN log_prob REAL")
+    total_unigram_count, vocab_size = conn.execute("SELECT SUM(count), COUNT(*) FROM ngrams WHERE order_n=1").fetchone()
+    total_unigram_count = total_unigram_count or 1
+    conn.create_function("gram_log_prob", 3, lambda order, count, prev_count: get_gram_log_prob(
+        order, count, prev_count or 0, total_unigram_count, vocab_size), deterministic=True)
+    conn.execute(f"UPDATE ngrams SET log_prob = gram_log_prob(order_n, count, (SELECT h.count FROM ngrams AS h "
+                 f"WHERE h.order_n = ngrams.order_n - 1 AND h.gram = ngrams.gram >> {ID_BITS}))")
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [("N", str(N)), ("alpha", repr(alpha))])
+    conn.commit()
+
+def ensure_log_probs(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        if has_fresh_log_probs(conn):
+            return False
+        write_log_probs(conn)
+        return True
+    finally:
+        conn.close()
+
+def check_log_probs(db_path):
+    # Loading never writes to the model; stale log-probs are recomputed by the build tools.
+    conn = connect_read_only(db_path)
+    try:
+        if not has_fresh_log_probs(conn):
+            raise ValueError(f"{db_path} has no log-probs for alpha={alpha!r}; "
+                             f"run migrate_ngram.py --input {db_path} or rebuild the model")
+    finally:
+        conn.close()
+
+def build_ngram_store(db_path, store_path, count_bits=32, log_prob_bits=64):
+    if is_legacy_db(db_path):
+        raise ValueError(f"{db_path} keys grams by string; run migrate_ngram.py first")
+    ensure_log_probs(db_path)
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*), MAX(order_n) FROM ngrams")
+    n_entries, n_order = cur.fetchone()
+    n_order = n_order or 0
+    capacity = get_capacity(n_entries)
+    mask = capacity - 1
+
+    codebook = None
+    if count_bits < 32:
+        cur.execute("SELECT DISTINCT count FROM ngrams")
+        codebook = get_count_codebook([min(row[0], 0xFFFFFFFF) for row in cur], count_bits)
+    log_prob_codebook = None
+    if log_prob_bits < 64:
+        cur.execute("SELECT log_prob FROM ngrams")
+        log_prob_codebook = get_log_prob_codebook([row[0] for row in cur], log_prob_bits)
+    typecode = COUNT_TYPECODES[count_bits]
+    log_prob_typecode = LOG_PROB_TYPECODES[log_prob_bits]
+    keys = array("Q", bytes(8 * capacity))
+    counts = array(typecode, bytes(array(typecode).itemsize * capacity))
+    log_probs = array(log_prob_typecode, bytes(array(log_prob_typecode).itemsize * capacity))
+    total_unigram_count = 0
+    vocab_size = 0
+
+    cur.execute("SELECT order_n, gram, count, log_prob FROM ngrams")
+    for order, key, count, log_prob in cur:
+        if order == 1:
+            total_unigram_count += count
+            vocab_size += 1
+        slot = key_hash(key) & mask
+        while keys[slot]:
+            slot = (slot + 1) & mask
+        keys[slot] = key
+        count = min(count, 0xFFFFFFFF)
+        counts[slot] = quantize_count(codebook, count) if codebook else count
+        log_probs[slot] = quantize_log_prob(log_prob_codebook, log_prob) if log_prob_codebook else log_prob
+
+    cur.execute("SELECT id, token FROM vocab")
+    vocab = sorted((string_hash(token), token_id) for token_id, token in cur)
+    for (h, _), (next_h, _) in zip(vocab, vocab[1:]):
+        if h == next_h:
+            raise ValueError("hash collision in token vocabulary")
+    vocab_hashes = array("Q", (h for h, _ in vocab))
+    vocab_ids = array("I", (token_id for _, token_id in vocab))
+    conn.close()
+
+    header = struct.pack(HEADER_FORMAT, STORE_MAGIC, STORE_VERSION, n_order, capacity, n_entries,
+                         total_unigram_count or 1, vocab_size, count_bits, len(codebook or ()), len(vocab), alpha, N,
+                         log_prob_bits, len(log_prob_codebook or ()))
+    tmp_path = store_path + ".tmp"
+    with open(tmp_path, "wb") as w:
+        w.write(header.ljust(HEADER_SIZE, b"\0"))
+        keys.tofile(w)
+        counts.tofile(w)
+        w.write(b"\0" * (-len(counts) * counts.itemsize % 8))
+        if codebook:
+            array("I", codebook).tofile(w)
+            w.write(b"\0" * (-len(codebook) * 4 % 8))
+        log_probs.tofile(w)
+        w.write(b"\0" * (-len(log_probs) * log_probs.itemsize % 8))
+        if log_prob_codebook:
+            array("d", log_prob_codebook).tofile(w)
+        vocab_hashes.tofile(w)
+        vocab_ids.tofile(w)
+    os.replace(tmp_path, store_path)
+
+class NgramStore:
+    def __init__(self, store_path=None, buffer=None):
+        self.mm = None
+        if buffer is None:
+            with open(store_path, "rb") as r:
+                self.mm = mmap.mmap(r.fileno(), 0, access=mmap.ACCESS_READ)
+            buffer = self.mm
+
+        magic, version, self.n_order, self.capacity, self.n_entries, self.total_unigram_count, self.vocab_size, \
+            self.count_bits, codebook_size, self.n_tokens, store_alpha, store_n, self.log_prob_bits, log_prob_codebook_size = \
+            struct.unpack_from(HEADER_FORMAT, buffer, 0)
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            raise ValueError(f"{store_path or 'buffer'} is not a version {STORE_VERSION} n-gram store")
+        if store_alpha != alpha or store_n != N:
+            raise ValueError(f"{store_path or 'buffer'} was built with N={store_n}, alpha={store_alpha}; rebuild it")
+
+        self.mask = self.capacity - 1
+        self.unmatched_log_prob = get_unmatched_log_prob(self.total_unigram_count, self.vocab_size)
+        view = memoryview(buffer)
+        pos = HEADER_SIZE
+        sections = []
+        for typecode, length in [("Q", self.capacity), (COUNT_TYPECODES[self.count_bits], self.capacity),
+                                 ("I", codebook_size), (LOG_PROB_TYPECODES[self.log_prob_bits], self.capacity),
+                                 ("d", log_prob_codebook_size), ("Q", self.n_tokens), ("I", self.n_tokens)]:
+            size = array(typecode).itemsize * length
+            sections.append(view[pos:pos + size].cast(typecode))
+            pos += size + (-size % 8)
+        self.keys, self.counts, self.codebook, self.log_probs, self.log_prob_codebook, self.vocab_hashes, self.vocab_ids = sections
+        if not codebook_size:
+            self.codebook.release()
+            self.codebook = None
+        if not log_prob_codebook_size:
+            self.log_prob_codebook.release()
+            self.log_prob_codebook = None
+        self.np_views = None
+        self.token_max_log_probs = None
+
+    def get_token_id(self, token):
+        h = string_hash(token)
+        i = bisect_left(self.vocab_hashes, h)
+        if i < self.n_tokens and self.vocab_hashes[i] == h:
+            return self.vocab_ids[i]
+        return 0
+
+    def find_slot(self, order, key):
+        # Stored keys never start with the OOV id 0, which would alias a lower order.
+        if not key >> (ID_BITS * (order - 1)):
+            return -1
+        keys = self.keys
+        mask = self.mask
+        slot = key_hash(key) & mask
+        while True:
+            k = keys[slot]
+            if k == key:
+                return slot
+            if not k:
+                return -1
+            slot = (slot + 1) & mask
+
+    def get_count(self, order, key):
+        slot = self.find_slot(order, key)
+        if slot < 0:
+            return 0
+        if self.codebook is not None:
+            return self.codebook[self.counts[slot]]
+        return self.counts[slot]
+
+    def get_log_prob(self, order, key):
+        slot = self.find_slot(order, key)
+        if slot < 0:
+            return None
+        if self.log_prob_codebook is not None:
+            return self.log_prob_codebook[self.log_probs[slot]]
+        return self.log_probs[slot]
+
+    def find_slots(self, order, keys):
+        # Vectorized find_slot over a uint64 key array; probes advance in lockstep.
+        if self.np_views is None:
+            self.np_views = (np.frombuffer(self.keys, dtype=np.uint64), np.frombuffer(self.counts, dtype=self.counts.format),
+                             None if self.codebook is None else np.frombuffer(self.codebook, dtype=np.uint32),
+                             np.frombuffer(self.log_probs, dtype=self.log_probs.format),
+                             None if self.log_prob_codebook is None else np.frombuffer(self.log_prob_codebook, dtype=np.float64))
+        table = self.np_views[0]
+        result = np.full(len(keys), -1, dtype=np.int64)
+        pending = np.flatnonzero(keys >> np.uint64(ID_BITS * (order - 1)))
+        slots = ((keys[pending] * np.uint64(KEY_MULTIPLIER)) >> np.uint64(32)) & np.uint64(self.mask)
+        while pending.size:
+            found = table[slots]
+            hit = found == keys[pending]
+            result[pending[hit]] = slots[hit]
+            miss = ~hit & (found != 0)
+            pending = pending[miss]
+            slots = (slots[miss] + np.uint64(1)) & np.uint64(self.mask)
+        return result
+
+    def get_counts(self, order, keys):
+        slots = self.find_slots(order, keys)
+        _, counts, codebook, _, _ = self.np_views
+        found = slots >= 0
+        result = np.zeros(len(keys), dtype=np.int64)
+        result[found] = counts[slots[found]] if codebook is None else codebook[counts[slots[found]]]
+        return result
+
+    def get_log_probs(self, order, keys):
+        slots = self.find_slots(order, keys)
+        found = slots >= 0
+        result = np.full(len(keys), np.nan)
+        log_probs, codebook = self.np_views[3:]
+        result[found] = log_probs[slots[found]] if codebook is None else codebook[log_probs[slots[found]]]
+        return result
+
+    def get_token_max_log_probs(self):
+        # Best log-prob of any stored gram ending in each token id, indexed by id.
+        if self.token_max_log_probs is None:
+            id_mask = (1 << ID_BITS) - 1
+            if np is not None:
+                keys = np.frombuffer(self.keys, dtype=np.uint64)
+                occupied = keys != 0
+                last_ids = (keys[occupied] & np.uint64(id_mask)).astype(np.int64)
+                best = np.full(int(last_ids.max(initial=0)) + 1, -np.inf)
+                log_probs = np.frombuffer(self.log_probs, dtype=self.log_probs.format)[occupied]
+                if self.log_prob_codebook is not None:
+                    log_probs = np.frombuffer(self.log_prob_codebook, dtype=np.float64)[log_probs]
+                np.maximum.at(best, last_ids, log_probs)
+                self.token_max_log_probs = best.tolist()
+            else:
+                best = {}
+                log_probs = self.log_probs if self.log_prob_codebook is None else (self.log_prob_codebook[j] for j in self.log_probs)
+                for key, log_prob in zip(self.keys, log_probs):
+                    if key and log_prob > best.get(key & id_mask, -math.inf):
+                        best[key & id_mask] = log_prob
+                self.token_max_log_probs = [best.get(token_id, -math.inf) for token_id in range(max(best, default=0) + 1)]
+        return self.token_max_log_probs
+
+    def close(self):
+        self.np_views = None
+        for view in (self.keys, self.counts, self.codebook, self.log_probs, self.log_prob_codebook, self.vocab_hashes, self.vocab_ids):
+            if view is not None:
+                view.release()
+        if self.mm is not None:
+            self.mm.close()
+
+if __name__ == '__main__':
+    build_ngram_store("ngram.db", "ngram.bin")
@@ -0,0 +1,43 @@
+import json
+import struct
+from constant import max_frame_size
+
+# Every message is a 4-byte big-endian length followed by a UTF-8 JSON object.
+# Requests may carry an "id" that is echoed in the reply, so clients can pipeline.
+FRAME_HEADER = struct.Struct(">I")
+
+def encode_frame(payload):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    if len(body) > max_frame_size:
+        raise ValueError(f"frame of {len(body)} bytes exceeds limit {max_frame_size}")
+    return FRAME_HEADER.pack(len(body)) + body
+
+def decode_body(body):
+    payload = json.loads(body.decode("utf-8"))
+    if not isinstance(payload, dict):
+        raise ValueError("frame payload must be a JSON object")
+    return payload
+
+def check_frame_size(size):
+    if size > max_frame_size:
+        raise ValueError(f"frame of {size} bytes exceeds limit {max_frame_size}")
+
+async def read_frame(reader):
+    size, = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+    check_frame_size(size)
+    return await reader.readexactly(size)
+
+def recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            raise ConnectionError("connection closed by peer")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+def recv_frame(sock):
+    size, = FRAME_HEADER.unpack(recv_exactly(sock, FRAME_HEADER.size))
+    check_frame_size(size)
+    return decode_body(recv_exactly(sock, size))
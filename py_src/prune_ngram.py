@@ -0,0 +1,199 @@
+import warnings
+warnings.filterwarnings("ignore", category=UserWarning, module="jieba")
+
+import os
+import json
+import sqlite3
+import argparse
+import tempfile
+import shutil
+import jieba
+import logging
+from collections import deque
+from time import perf_counter
+from tqdm import tqdm
+from constant import N, correct_threshold, prune_min_count_per_order, prune_loss_threshold, prune_count_bits, \
+    prune_log_prob_bits
+from corpus_stream import iter_lines
+from get_ngram import create_schema, write_vocab
+from ngram_store import ID_BITS, pack_ids, unpack_key, build_ngram_store, write_log_probs, get_gram_log_prob, get_unmatched_log_prob
+from sentence_evaluator import NgramModel, han_pattern, get_token_log_prob, calculate_ngram_score
+jieba.setLogLevel(logging.ERROR)
+
+class CountsModel:
+    def __init__(self, counts, total_unigram_count, vocab_size):
+        self.counts = counts
+        self.total_unigram_count = total_unigram_count
+        self.vocab_size = vocab_size
+        self.unmatched_log_prob = get_unmatched_log_prob(total_unigram_count, vocab_size)
+        self.excluded = None
+
+    def get_count(self, order, key):
+        if (order, key) == self.excluded:
+            return 0
+        return self.counts[order].get(key, 0)
+
+    def get_log_prob(self, order, key):
+        count = self.get_count(order, key)
+        if not count:
+            return None
+        prev_count = self.get_count(order - 1, key >> ID_BITS) if order > 1 else 0
+        return get_gram_log_prob(order, count, prev_count, self.total_unigram_count, self.vocab_size)
+
+def load_counts(db_path, n_order=N):
+    counts = {order: {} for order in range(1, n_order + 1)}
+    conn = sqlite3.connect(db_path)
+    for order, key, count in conn.execute("SELECT order_n, gram, count FROM ngrams"):
+        if order in counts:
+            counts[order][key] = count
+    vocab = {token: token_id for token_id, token in conn.execute("SELECT id, token FROM vocab")}
+    conn.close()
+    return counts, vocab
+
+def get_min_count(min_counts, order):
+    return min_counts[min(order, len(min_counts)) - 1]
+
+def prune_counts(counts, min_counts, threshold, n_order=N):
+    pruned = {order: {key: count for key, count in grams.items() if count >= get_min_count(min_counts, order)}
+              for order, grams in counts.items()}
+    model = CountsModel(pruned, sum(counts[1].values()) or 1, len(counts[1]))
+
+    protected = set()
+    for order in range(n_order, 1, -1):
+        grams = pruned[order]
+        order_total = sum(grams.values()) or 1
+        if threshold > 0:
+            for key, count in tqdm(list(grams.items()), desc=f"Pruning order {order}"):
+                if key in protected:
+                    continue
+                ids = unpack_key(key, order)
+                full = get_token_log_prob(ids, order - 1, model, n_order)
+                model.excluded = (order, key)
+                backoff = get_token_log_prob(ids, order - 1, model, n_order)
+                model.excluded = None
+                if count / order_total * abs(full - backoff) < threshold:
+                    del grams[key]
+        # A kept gram's history is the denominator of its probability, so it must survive.
+        protected = {key >> ID_BITS for key in grams}
+    pruned[1] = {key: count for key, count in pruned[1].items() if count >= get_min_count(min_counts, 1) or key in protected}
+    return pruned
+
+def write_counts(counts, vocab, db_path):
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    create_schema(cur)
+    write_vocab(cur, vocab)
+    rows = ((order, gram, count) for order, grams in counts.items() for gram, count in grams.items())
+    cur.executemany('INSERT INTO ngrams (order_n, gram, count) VALUES (?, ?, ?)', rows)
+    write_log_probs(conn)
+    conn.close()
+
+def get_heldout_sentences(heldout_path, n_sentences):
+    if heldout_path and os.path.exists(heldout_path):
+        return list(iter_lines(heldout_path))[:n_sentences]
+    return list(deque(iter_lines("corpus_cleaned_metadata.txt"), maxlen=n_sentences))
+
+def get_lookup_keys(sentences, model, n_order=N):
+    keys = []
+    for sentence in sentences:
+        ids = model.get_token_ids(jieba.lcut("".join(han_pattern.findall(sentence))))
+        for i in range(len(ids)):
+            for order in range(1, min(n_order, i + 1) + 1):
+                keys.append((order, pack_ids(ids[i - order + 1:i + 1])))
+    return keys
+
+def time_lookups(model, keys, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        for order, gram in keys:
+            model.get_count(order, gram)
+        best = min(best, perf_counter() - start)
+    return best / len(keys) * 1e6 if keys else 0.0
+
+def compare_scores(base_model, pruned_model, sentences, threshold=correct_threshold):
+    diffs = []
+    decisions_agree = 0
+    for sentence in sentences:
+        base = calculate_ngram_score(sentence, base_model, n_order=N)
+        pruned = calculate_ngram_score(sentence, pruned_model, n_order=N)
+        diffs.append(abs(base - pruned))
+        decisions_agree += (base >= threshold) == (pruned >= threshold)
+    n = len(sentences) or 1
+    return {
+        "sentences": len(sentences),
+        "mean_abs_diff": sum(diffs) / n,
+        "max_abs_diff": max(diffs, default=0.0),
+        "within_1_point": sum(d <= 1.0 for d in diffs) / n,
+        "threshold_agreement": decisions_agree / n,
+    }
+
+def prune_entry(args):
+    min_counts = [int(x) for x in args.min_count.split(",")]
+    counts, vocab = load_counts(args.model)
+    pruned = prune_counts(counts, min_counts, args.threshold)
+    write_counts(pruned, vocab, args.output)
+    build_ngram_store(args.output, args.store, args.count_bits, args.log_prob_bits)
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        base_store = os.path.join(temp_dir, "ngram.bin")
+        build_ngram_store(args.model, base_store)
+        exact_store = os.path.join(temp_dir, "ngram.pruned.bin")
+        build_ngram_store(args.output, exact_store)
+        base_model = NgramModel(base_store)
+        exact_model = NgramModel(exact_store)
+        pruned_model = NgramModel(args.store)
+
+        sentences = get_heldout_sentences(args.heldout, args.sentences)
+        keys = get_lookup_keys(sentences, base_model)
+        return {
+            "params": {"min_count": min_counts, "threshold": args.threshold, "count_bits": args.count_bits,
+                       "log_prob_bits": args.log_prob_bits},
+            "entries": {str(order): {"before": len(counts[order]), "after": len(pruned[order])} for order in counts},
+            "size_bytes": {
+                "db_before": os.path.getsize(args.model),
+                "db_after": os.path.getsize(args.output),
+                "store_before": os.path.getsize(base_store),
+                "store_after_unquantized": os.path.getsize(exact_store),
+                "store_after": os.path.getsize(args.store),
+            },
+            "lookup_us": {"before": time_lookups(base_model, keys), "after": time_lookups(pruned_model, keys)},
+            "scoring": compare_scores(base_model, pruned_model, sentences),
+            "quantization": compare_scores(exact_model, pruned_model, sentences),
+        }
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="ngram.db")
+    parser.add_argument("--output", default="ngram.pruned.db")
+    parser.add_argument("--store", default="ngram.pruned.bin")
+    parser.add_argument("--min-count", default=",".join(map(str, prune_min_count_per_order)))
+    parser.add_argument("--threshold", type=float, default=prune_loss_threshold)
+    parser.add_argument("--count-bits", type=int, choices=[8, 16, 32], default=prune_count_bits)
+    parser.add_argument("--log-prob-bits", type=int, choices=[8, 16, 64], default=prune_log_prob_bits)
+    parser.add_argument("--heldout", default="heldout.txt")
+    parser.add_argument("--sentences", type=int, default=500)
+    parser.add_argument("--report", default="prune_report.json")
+    args = parser.parse_args()
+
+    report = prune_entry(args)
+    with open(args.report, "w", encoding="utf-8") as w:
+        json.dump(report, w, ensure_ascii=False, indent=2)
+
+    for order, row in report["entries"].items():
+        print(f"order {order}: {row['before']} -> {row['after']} grams")
+    size = report["size_bytes"]
+    print(f"store size: {size['store_before']} -> {size['store_after_unquantized']} pruned -> "
+          f"{size['store_after']} quantized bytes | "
+          f"lookup: {report['lookup_us']['before']:.2f} -> {report['lookup_us']['after']:.2f} us")
+    scoring = report["scoring"]
+    print(f"score diff mean {scoring['mean_abs_diff']:.3f} max {scoring['max_abs_diff']:.3f} | "
+          f"threshold agreement {scoring['threshold_agreement']:.1%}")
+    quantization = report["quantization"]
+    print(f"quantization alone: score diff mean {quantization['mean_abs_diff']:.3f} "
+          f"max {quantization['max_abs_diff']:.3f} | threshold agreement {quantization['threshold_agreement']:.1%}")
@@ -0,0 +1,105 @@
+import os
+import json
+import threading
+from lru import LRUCache, MISSING
+from constant import result_cache_entries, result_cache_save_interval
+
+RESULT_CACHE_VERSION = 1
+
+def split_sentence(sentence):
+    # Surrounding whitespace never takes part in a correction, so it is kept out
+    # of the cache key and put back around the cached result.
+    text = sentence.strip()
+    head = len(sentence) - len(sentence.lstrip())
+    return text, sentence[:head], sentence[head + len(text):]
+
+def get_reply(result, head, tail):
+    return (head + result[0] + tail,) + tuple(result[1:])
+
+class CachedCorrector:
+    def __init__(self, corrector, max_entries=result_cache_entries, path=None, save_interval=result_cache_save_interval):
+        self.corrector = corrector
+        self.cache = LRUCache(max_entries, "result_cache")
+        self.path = path
+        self.save_interval = save_interval
+        self.save_lock = threading.Lock()
+        self.unsaved = 0
+        self.fingerprint = corrector.get_fingerprint()
+        if path:
+            self.load()
+
+    def __getattr__(self, name):
+        return getattr(self.corrector, name)
+
+    def get_key(self, text, threshold, n_correct, decoder):
+        return text, threshold, n_correct, decoder or self.corrector.decoder
+
+    def store(self, key, result):
+        self.cache.put(key, tuple(result[:3]))
+        if self.path:
+            self.unsaved += 1
+            if self.unsaved >= self.save_interval:
+                self.save()
+
+    def correct(self, sentence, threshold, n_correct=4, decoder=None):
+        return self.correct_within(sentence, threshold, None, n_correct, decoder)[:3]
+
+    def correct_within(self, sentence, threshold, deadline_ms, n_correct=4, decoder=None):
+        text, head, tail = split_sentence(sentence)
+        key = self.get_key(text, threshold, n_correct, decoder)
+        result = self.cache.get(key)
+        if result is MISSING:
+            result = self.corrector.correct_within(text, threshold, deadline_ms, n_correct, decoder)
+            if result[3]:
+                self.store(key, result)
+        else:
+            # Only finished searches are cached, so a cached result is a finished one.
+            result += (True,)
+        return get_reply(result, head, tail)
+
+    def correct_batch(self, sentences, threshold, n_correct=4, decoder=None):
+        return [result[:3] for result in self.correct_batch_within(sentences, threshold, None, n_correct, decoder)]
+
+    def correct_batch_within(self, sentences, threshold, deadline_ms, n_correct=4, decoder=None):
+        parts = [split_sentence(sentence) for sentence in sentences]
+        keys = [self.get_key(text, threshold, n_correct, decoder) for text, _, _ in parts]
+        results = {}
+        for key in keys:
+            if key not in results:
+                result = self.cache.get(key)
+                results[key] = result if result is MISSING else result + (True,)
+        missing = [key for key, result in results.items() if result is MISSING]
+        if missing:
+            for key, result in zip(missing, self.corrector.correct_batch_within([key[0] for key in missing], threshold,
+                                                                                deadline_ms, n_correct, decoder)):
+                results[key] = result
+                if result[3]:
+                    self.store(key, result)
+
+        return [get_reply(results[key], head, tail) for key, (_, head, tail) in zip(keys, parts)]
+
+    def get_cache_info(self):
+        return dict(self.corrector.get_cache_info(), result=self.cache.info())
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as r:
+                data = json.load(r)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != RESULT_CACHE_VERSION or data.get("fingerprint") != self.fingerprint:
+            return
+        for key, result in data["entries"]:
+            self.cache.put(tuple(key), tuple(result))
+
+    def save(self):
+        if not self.path:
+            return
+        with self.save_lock:
+            self.unsaved = 0
+            data = {"version": RESULT_CACHE_VERSION, "fingerprint": self.fingerprint,
+                    "entries": [[list(key), list(result)] for key, result in self.cache.items()]}
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as w:
+                json.dump(data, w, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
@@ -2,27 +2,129 @@ import warnings
 warnings.filterwarnings("ignore", category=UserWarning, module="jieba")
 
 import re
+import copy
 import math
 import jieba
 import logging
-import sqlite3
+from bisect import bisect_left, bisect_right
+from itertools import chain, accumulate
 from time import time
-from constant import N
+from constant import N, candidate_bound_margin, ngram_cache_entries, segment_cache_entries
+from lru import LRUCache, MISSING
+from ngram_store import NgramStore, ID_BITS, pack_ids, is_ngram_store, is_legacy_db, check_log_probs, \
+    connect_read_only, get_unmatched_log_prob
+from stats import stats
 jieba.setLogLevel(logging.ERROR)
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+batch_scoring_available = np is not None
+
 class NgramModel:
-    def __init__(self, db_path="ngram.db"):
-        self.conn = sqlite3.connect(db_path)
+    def __init__(self, db_path="ngram.db", store=None, cache_entries=ngram_cache_entries):
+        if store is not None or is_ngram_store(db_path):
+            self.conn = None
+            self.store = store or NgramStore(db_path)
+            self.total_unigram_count = self.store.total_unigram_count
+            self.vocab_size = self.store.vocab_size
+            self.get_token_id = self.store.get_token_id
+        else:
+            if is_legacy_db(db_path):
+                raise ValueError(f"{db_path} keys grams by string; run migrate_ngram.py first")
+            check_log_probs(db_path)
+            self.store = None
+            self.db_path = db_path
+            self.connect()
+            self.vocab = dict((token, token_id) for token_id, token in self.conn.execute("SELECT id, token FROM vocab"))
+            self.total_unigram_count = self.get_total_unigram_count()
+            self.vocab_size = self.get_vocab_size()
+        self.unmatched_log_prob = get_unmatched_log_prob(self.total_unigram_count, self.vocab_size)
+        self.token_max_log_probs = None
+        self.cache = LRUCache(cache_entries, "ngram_cache") if cache_entries else None
+
+    def connect(self):
+        self.conn = connect_read_only(self.db_path, check_same_thread=False)
         self.conn.isolation_level = None
-        self.total_unigram_count = self.get_total_unigram_count()
-        self.vocab_size = self.get_vocab_size()
 
-    def get_count(self, order, gram):
+    def after_fork(self):
+        # An sqlite connection must not be shared across fork; stores are plain mmaps.
+        if self.store is None:
+            self.connect()
+
+    def get_token_id(self, token):
+        return self.vocab.get(token, 0)
+
+    def get_token_ids(self, tokens):
+        get_token_id = self.get_token_id
+        return [get_token_id(token) for token in tokens]
+
+    def get_gram_count(self, tokens):
+        return self.get_count(len(tokens), pack_ids(self.get_token_ids(tokens)))
+
+    def get_counts(self, order, keys):
+        if stats.enabled:
+            stats.incr("ngram.lookups", len(keys))
+        if self.store is not None:
+            return self.store.get_counts(order, keys)
+        return np.array([self.get_count(order, int(key)) for key in keys], dtype=np.int64)
+
+    def get_log_probs(self, order, keys):
+        if stats.enabled:
+            stats.incr("ngram.lookups", len(keys))
+        if self.store is not None:
+            return self.store.get_log_probs(order, keys)
+        log_probs = [self.get_log_prob(order, int(key)) for key in keys]
+        return np.array([np.nan if log_prob is None else log_prob for log_prob in log_probs])
+
+    def get_count(self, order, key):
+        if self.cache is not None:
+            return get_cached(self.cache, (order, key), self.lookup_count, order, key)
+        return self.lookup_count(order, key)
+
+    def get_log_prob(self, order, key):
+        if self.cache is not None:
+            return get_cached(self.cache, (-order, key), self.lookup_log_prob, order, key)
+        return self.lookup_log_prob(order, key)
+
+    def lookup_count(self, order, key):
+        if stats.enabled:
+            stats.incr("ngram.lookups")
+        if self.store is not None:
+            return self.store.get_count(order, key)
         cursor = self.conn.cursor()
-        cursor.execute("SELECT count FROM ngrams WHERE order_n=? AND gram=?", (order, gram))
+        cursor.execute("SELECT count FROM ngrams WHERE order_n=? AND gram=?", (order, key))
         result = cursor.fetchone()
         return result[0] if result else 0
 
+    def lookup_log_prob(self, order, key):
+        if stats.enabled:
+            stats.incr("ngram.lookups")
+        if self.store is not None:
+            return self.store.get_log_prob(order, key)
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT log_prob FROM ngrams WHERE order_n=? AND gram=?", (order, key))
+        result = cursor.fetchone()
+        return result[0] if result else None
+
+    def get_token_max_log_prob(self, token_id):
+        # Upper bound on get_token_log_prob for this token in any context.
+        if self.token_max_log_probs is None:
+            if self.store is not None:
+                best = self.store.get_token_max_log_probs()
+            else:
+                rows = self.conn.execute("SELECT gram & ?, MAX(log_prob) FROM ngrams GROUP BY 1", ((1 << ID_BITS) - 1,)).fetchall()
+                best = [-math.inf] * (max((last_id for last_id, _ in rows), default=0) + 1)
+                for last_id, log_prob in rows:
+                    best[last_id] = log_prob
+            self.token_max_log_probs = [max(log_prob, self.unmatched_log_prob) for log_prob in best]
+            self.token_max_log_probs[0] = self.unmatched_log_prob
+        if token_id < len(self.token_max_log_probs):
+            return self.token_max_log_probs[token_id]
+        return self.unmatched_log_prob
+
     def get_total_unigram_count(self):
         cursor = self.conn.cursor()
         cursor.execute("SELECT SUM(count) FROM ngrams WHERE order_n=1")
@@ -35,51 +137,414 @@ class NgramModel:
         result = cursor.fetchone()
         return result[0] if result else 0
 
+def get_cached(cache, cache_key, lookup, order, key):
+    value = cache.get(cache_key)
+    if value is MISSING:
+        value = cache.put(cache_key, lookup(order, key))
+    return value
+
+han_pattern = re.compile(r'[\u4e00-\u9fa5]+')
+
+segment_cache = LRUCache(segment_cache_entries, "segment_cache") if segment_cache_entries else None
+
+def segment(text):
+    if segment_cache is None:
+        return jieba.lcut(text)
+    tokens = segment_cache.get(text)
+    if tokens is MISSING:
+        tokens = segment_cache.put(text, tuple(jieba.lcut(text)))
+    return list(tokens)
+
+def get_token_log_prob(ids, i, model, n_order=3):
+    keys = []
+    key = 0
+    for order in range(1, min(i + 1, n_order) + 1):
+        key |= ids[i - order + 1] << (ID_BITS * (order - 1))
+        keys.append(key)
+
+    for order in range(len(keys), 0, -1):
+        log_prob = model.get_log_prob(order, keys[order - 1])
+        if log_prob is not None:
+            return log_prob
+    return model.unmatched_log_prob
+
+def get_token_match_chars(token, token_id, model):
+    return len(token) if model.get_count(1, token_id) > 0 else 0
+
+def get_sentence_score(log_probs, match_chars, line_length):
+    avg_lp = math.fsum(log_probs) / len(log_probs)
+    match_ratio = match_chars / line_length
+    length_bonus = math.log10(line_length) * 100
+    return (avg_lp + 15) * 10 * (match_ratio ** 2) + length_bonus
+
+def get_ids_score(ids, lengths, model, n_order=3):
+    log_probs = [get_token_log_prob(ids, i, model, n_order) for i in range(len(ids))]
+    match_chars = sum(length for length, token_id in zip(lengths, ids) if model.get_count(1, token_id) > 0)
+    return get_sentence_score(log_probs, match_chars, sum(lengths))
+
 def calculate_ngram_score(sentence, model, n_order=3):
-    line = "".join(re.findall(r'[\u4e00-\u9fa5]+', sentence))
+    start = stats.start()
+    line = "".join(han_pattern.findall(sentence))
     if not line: return -999.0
 
-    tokens = jieba.lcut(line)
-    n_tokens = len(tokens)
+    segment_start = stats.start()
+    tokens = segment(line)
+    stats.stop("score.segment", segment_start)
+
+    score = get_ids_score(model.get_token_ids(tokens), [len(token) for token in tokens], model, n_order)
+    stats.stop("score.full", start)
+    return score
+
+def score_id_batch(ids_batch, lengths_batch, model, n_order=3):
+    # Same formula as get_ids_score, evaluated for every token of every sequence at
+    # once; scores agree with the scalar path up to float rounding.
+    if np is None:
+        return [get_ids_score(ids, lengths, model, n_order) if ids else -999.0
+                for ids, lengths in zip(ids_batch, lengths_batch)]
+    start = stats.start()
+    sizes = np.array([len(ids) for ids in ids_batch], dtype=np.int64)
+    total = int(sizes.sum())
+    flat_ids = np.fromiter(chain.from_iterable(ids_batch), dtype=np.uint64, count=total)
+    flat_lengths = np.fromiter(chain.from_iterable(lengths_batch), dtype=np.float64, count=total)
+    seq = np.repeat(np.arange(len(ids_batch)), sizes)
+    pos = np.arange(total) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+
+    log_probs = np.full(total, model.unmatched_log_prob)
+    resolved = np.zeros(total, dtype=bool)
+    keys_by_order = [flat_ids]
+    for order in range(2, n_order + 1):
+        shifted = np.zeros(total, dtype=np.uint64)
+        shifted[order - 1:] = flat_ids[:total - order + 1]
+        keys_by_order.append(keys_by_order[-1] | (shifted << np.uint64(ID_BITS * (order - 1))))
+
+    for order in range(n_order, 0, -1):
+        idx = np.flatnonzero(~resolved & (pos >= order - 1))
+        order_log_probs = model.get_log_probs(order, keys_by_order[order - 1][idx])
+        hit = ~np.isnan(order_log_probs)
+        log_probs[idx[hit]] = order_log_probs[hit]
+        resolved[idx[hit]] = True
+    unigram_counts = model.get_counts(1, flat_ids)
 
-    alpha = 0.0001
-    total_log_prob = 0
-    match_chars = 0
+    n_seq = len(ids_batch)
+    line_lengths = np.bincount(seq, weights=flat_lengths, minlength=n_seq)
+    match_chars = np.bincount(seq, weights=flat_lengths * (unigram_counts > 0), minlength=n_seq)
+    avg_lp = np.bincount(seq, weights=log_probs, minlength=n_seq) / np.maximum(sizes, 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = (avg_lp + 15) * 10 * (match_chars / line_lengths) ** 2 + np.log10(line_lengths) * 100
+    scores[sizes == 0] = -999.0
+    stats.stop("score.batch", start)
+    return scores.tolist()
 
-    for i in range(n_tokens):
-        prob = 0
-        found_match = False
+def calculate_ngram_scores(sentences, model, n_order=3):
+    ids_batch, lengths_batch = [], []
+    for sentence in sentences:
+        tokens = segment("".join(han_pattern.findall(sentence)))
+        ids_batch.append(model.get_token_ids(tokens))
+        lengths_batch.append([len(token) for token in tokens])
+    return score_id_batch(ids_batch, lengths_batch, model, n_order)
 
-        for order in range(min(i + 1, n_order), 0, -1):
-            gram_str = "".join(tokens[i - order + 1: i + 1])
-            gram_count = model.get_count(order, gram_str)
+_max_word_length_cache = {}
 
-            if gram_count > 0:
-                if order == 1:
-                    prob = (gram_count + alpha) / (model.total_unigram_count + alpha * model.vocab_size)
-                else:
-                    prev_gram_str = "".join(tokens[i - order + 1: i])
-                    prev_count = model.get_count(order - 1, prev_gram_str)
-                    prob = (gram_count + alpha) / (prev_count + alpha * model.vocab_size)
+def get_max_word_length():
+    freq = jieba.dt.FREQ
+    key = (id(freq), len(freq))
+    if key not in _max_word_length_cache:
+        _max_word_length_cache.clear()
+        _max_word_length_cache[key] = getattr(freq, "max_key_length", None) or max(map(len, freq))
+    return _max_word_length_cache[key]
 
-                if order < n_order:
-                    prob *= (0.01 ** (n_order - order))
-                found_match = True
+def has_word_across(text, pos):
+    freq = jieba.dt.FREQ
+    n = len(text)
+    for k in range(max(0, pos - get_max_word_length() + 1), pos):
+        i = k
+        frag = text[k]
+        while i < n and frag in freq:
+            if i >= pos and freq[frag]:
+                return True
+            i += 1
+            frag = text[k:i + 1]
+    return False
+
+def get_safe_cuts(line, boundaries):
+    # A token boundary can be cut without changing jieba's output when no dictionary
+    # word spans it and the route word on the kept side is multi-char, so the HMM
+    # buffer of single chars never runs across the cut.
+    jieba.dt.check_initialized()
+    dag = jieba.dt.get_DAG(line)
+    route = {}
+    jieba.dt.calc(line, dag, route)
+
+    n = len(line)
+    crossed = bytearray(n + 1)
+    for k, ends in dag.items():
+        for j in ends:
+            for p in range(k + 1, j + 1):
+                crossed[p] = 1
+
+    word_end_length = [0] * (n + 1)
+    word_start_length = [0] * (n + 1)
+    x = 0
+    while x < n:
+        y = route[x][1] + 1
+        word_start_length[x] = word_end_length[y] = y - x
+        x = y
+
+    left_safe = [not crossed[p] and word_end_length[p] > 1 for p in boundaries]
+    right_safe = [not crossed[p] and word_start_length[p] > 1 for p in boundaries]
+    left_safe[0] = right_safe[-1] = True
+    return left_safe, right_safe
+
+class IncrementalScorer:
+    def __init__(self, sentence, model, n_order=3, base=None):
+        start = stats.start()
+        self.sentence = sentence
+        self.model = model
+        self.n_order = n_order
+
+        chars = []
+        self.line_index = [0]
+        for ch in sentence:
+            if han_pattern.match(ch):
+                chars.append(ch)
+            self.line_index.append(len(chars))
+        self.line = "".join(chars)
+
+        if not self.line:
+            self.score = -999.0
+            return
+
+        self.segmented_edits = {}
+        self.windows = {}
+        self.base_segmented_edits = self.base_windows = None
+        if base is not None and getattr(base, "line", "") and base.model is model and base.n_order == n_order:
+            self.tokens, n_kept = self.extend_tokens(base)
+        else:
+            segment_start = stats.start()
+            self.tokens, n_kept = segment(self.line), 0
+            stats.stop("score.segment", segment_start)
+        self.boundaries = [0]
+        for token in self.tokens:
+            self.boundaries.append(self.boundaries[-1] + len(token))
+
+        self.ids = model.get_token_ids(self.tokens)
+        self.lengths = [len(token) for token in self.tokens]
+        self.log_probs = base.log_probs[:n_kept] if n_kept else []
+        self.log_probs += [get_token_log_prob(self.ids, i, model, n_order) for i in range(n_kept, len(self.ids))]
+        self.match_prefix = base.match_prefix[:n_kept + 1] if n_kept else [0]
+        for token, token_id in zip(self.tokens[n_kept:], self.ids[n_kept:]):
+            self.match_prefix.append(self.match_prefix[-1] + get_token_match_chars(token, token_id, model))
+        self.log_prob_prefix = [0.0]
+        for log_prob in self.log_probs:
+            self.log_prob_prefix.append(self.log_prob_prefix[-1] + log_prob)
+
+        self.left_safe, self.right_safe = get_safe_cuts(self.line, self.boundaries)
+        if n_kept:
+            self.inherit_edits(base, n_kept)
+        self.score = get_sentence_score(self.log_probs, self.match_prefix[-1], len(self.line))
+        stats.stop("score.incremental_init", start)
+
+    def extend_tokens(self, base):
+        # The new sentence is base.sentence with its tail replaced, so its tokens are
+        # the base tokens up to the last safe cut plus a segmentation of the rest.
+        p = 0
+        for old, new in zip(base.sentence, self.sentence):
+            if old != new:
                 break
+            p += 1
+        edit = base.resegment_edit(p, len(base.sentence), self.sentence[p:])
+        i_left, _, mid_tokens, _ = edit
+        self.stable_chars = base.line_index[p]
+        return base.tokens[:i_left] + mid_tokens, i_left
 
-        if not found_match:
-            prob = alpha / (model.total_unigram_count + alpha * model.vocab_size)
-            prob *= (0.1 ** n_order)
+    def inherit_edits(self, base, n_kept):
+        # Edits of the base sentence that stay clear of the changed tail keep their
+        # segmentation and window scores; is_stable decides which ones those are.
+        self.stable_tokens = n_kept
+        for i in range(n_kept + 1):
+            if self.left_safe[i] != base.left_safe[i] or self.right_safe[i] != base.right_safe[i]:
+                self.stable_tokens = i
+                break
+        self.base_segmented_edits = base.segmented_edits
+        self.base_windows = base.windows
 
-        total_log_prob += math.log10(prob)
+    def is_stable(self, i_right, n_context):
+        return i_right + n_context <= self.stable_tokens and \
+            self.boundaries[i_right] + get_max_word_length() <= self.stable_chars
 
-        if model.get_count(1, tokens[i]) > 0:
-            match_chars += len(tokens[i])
+    def get_inherited(self, cache, base_cache, edit_key, n_context):
+        entry = cache.get(edit_key, MISSING)
+        if entry is MISSING and base_cache is not None:
+            entry = base_cache.get(edit_key, MISSING)
+            if entry is None or entry is not MISSING and not self.is_stable(entry[1], n_context):
+                entry = MISSING
+            elif entry is not MISSING:
+                cache[edit_key] = entry
+        return entry
 
-    avg_lp = total_log_prob / n_tokens
-    match_ratio = match_chars / len(line) if line else 0
-    length_bonus = math.log10(len(line)) * 100
-    return (avg_lp + 15) * 10 * (match_ratio ** 2) + length_bonus
+    def resegment_edit(self, start, end, replacement):
+        edit_key = (start, end, replacement)
+        edit = self.get_inherited(self.segmented_edits, self.base_segmented_edits, edit_key, 1)
+        if edit is MISSING:
+            edit = self.segmented_edits[edit_key] = self.segment_edit(start, end, replacement)
+        if edit is None:
+            return None
+        i_left, i_right, mid_tokens, delta = edit
+        return i_left, i_right, mid_tokens, len(self.line) + delta
+
+    def segment_edit(self, start, end, replacement):
+        a = self.line_index[start]
+        b = self.line_index[end]
+        rep = "".join(han_pattern.findall(replacement))
+        line = self.line[:a] + rep + self.line[b:]
+        if not line:
+            return None
+        delta = len(rep) - (b - a)
+
+        boundaries = self.boundaries
+        n_tokens = len(self.tokens)
+        i_left = bisect_right(boundaries, a) - 1
+        i_right = bisect_left(boundaries, b)
+        while i_left > 0 and not (self.left_safe[i_left] and not has_word_across(line, boundaries[i_left])):
+            i_left -= 1
+        while i_right < n_tokens and not (self.right_safe[i_right] and not has_word_across(line, boundaries[i_right] + delta)):
+            i_right += 1
+
+        segment_start = stats.start()
+        mid_tokens = segment(line[boundaries[i_left]: boundaries[i_right] + delta])
+        stats.stop("score.segment", segment_start)
+        return i_left, i_right, mid_tokens, delta
+
+    def get_span_log_prob(self, start, end):
+        # Lowest log-prob among the tokens overlapping sentence[start:end].
+        if not self.line:
+            return 0.0
+        a = self.line_index[start]
+        b = self.line_index[end]
+        i_left = bisect_right(self.boundaries, a) - 1
+        i_right = max(bisect_left(self.boundaries, b), i_left + 1)
+        return min(self.log_probs[i_left:i_right], default=0.0)
+
+    def bound_edit(self, start, end, replacement):
+        # Upper bound on score_edit that skips the context lookups: the re-segmented
+        # tokens and their unigram matches are exact, while every re-scored token is
+        # credited with the best log-prob its id reaches in any context.
+        if not self.line:
+            return math.inf
+        edit = self.resegment_edit(start, end, replacement)
+        if edit is None: return -999.0
+        i_left, i_right, mid_tokens, line_length = edit
+
+        model = self.model
+        tail_end = min(len(self.tokens), i_right + self.n_order - 1)
+        mid_ids = model.get_token_ids(mid_tokens)
+        log_prob_sum = self.log_prob_prefix[i_left] + self.log_prob_prefix[-1] - self.log_prob_prefix[tail_end] + \
+            sum(model.get_token_max_log_prob(token_id) for token_id in chain(mid_ids, self.ids[i_right:tail_end]))
+        avg_lp = log_prob_sum / (i_left + len(mid_ids) + len(self.tokens) - i_right)
+        match_chars = self.match_prefix[i_left] + self.match_prefix[-1] - self.match_prefix[i_right] + \
+            sum(get_token_match_chars(token, token_id, model) for token, token_id in zip(mid_tokens, mid_ids))
+        return get_sentence_score([avg_lp], match_chars, line_length) + candidate_bound_margin
+
+    def edit_ids(self, start, end, replacement):
+        if not self.line:
+            tokens = segment("".join(han_pattern.findall(self.sentence[:start] + replacement + self.sentence[end:])))
+            return self.model.get_token_ids(tokens), [len(token) for token in tokens]
+        edit = self.resegment_edit(start, end, replacement)
+        if edit is None:
+            return [], []
+        i_left, i_right, mid_tokens, _ = edit
+        ids = self.ids[:i_left] + self.model.get_token_ids(mid_tokens) + self.ids[i_right:]
+        lengths = self.lengths[:i_left] + [len(token) for token in mid_tokens] + self.lengths[i_right:]
+        return ids, lengths
+
+    def get_edit_window(self, start, end, replacement):
+        edit_key = (start, end, replacement)
+        window = self.get_inherited(self.windows, self.base_windows, edit_key, max(1, self.n_order - 1))
+        if window is not MISSING:
+            return window
+        edit = self.resegment_edit(start, end, replacement)
+        if edit is None:
+            self.windows[edit_key] = None
+            return None
+        i_left, i_right, mid_tokens, line_length = edit
+
+        tail_end = min(len(self.tokens), i_right + self.n_order - 1)
+        head_start = max(0, i_left - self.n_order + 1)
+        mid_ids = self.model.get_token_ids(mid_tokens)
+        window = self.ids[head_start:i_left] + mid_ids + self.ids[i_right:tail_end]
+        window_log_probs = [get_token_log_prob(window, i, self.model, self.n_order)
+                            for i in range(i_left - head_start, len(window))]
+        mid_match_chars = sum(get_token_match_chars(token, token_id, self.model) for token, token_id in zip(mid_tokens, mid_ids))
+        window = self.windows[edit_key] = (i_left, i_right, window_log_probs, mid_match_chars, line_length - len(self.line))
+        return window
+
+    def apply_edit(self, start, end, replacement):
+        # Scorer of the edited sentence derived from this one. The re-segmented span is
+        # bounded by cuts no word crosses in either sentence, so tokens, log-probs and
+        # safe cuts outside it carry over and only the span itself is looked up again.
+        sentence = self.sentence[:start] + replacement + self.sentence[end:]
+        window = self.get_edit_window(start, end, replacement) if self.line else None
+        if window is None:
+            return IncrementalScorer(sentence, self.model, self.n_order)
+        timer_start = stats.start()
+        i_left, i_right, window_log_probs, _, delta = window
+        mid_tokens = self.resegment_edit(start, end, replacement)[2]
+        mid_ids = self.model.get_token_ids(mid_tokens)
+        mid_lengths = [len(token) for token in mid_tokens]
+        tail_end = min(len(self.tokens), i_right + self.n_order - 1)
+
+        child = copy.copy(self)
+        child.sentence = sentence
+        a, b = self.line_index[start], self.line_index[end]
+        rep = "".join(han_pattern.findall(replacement))
+        child.line = self.line[:a] + rep + self.line[b:]
+        child.line_index = self.line_index[:start + 1]
+        for ch in replacement:
+            child.line_index.append(child.line_index[-1] + bool(han_pattern.match(ch)))
+        child.line_index += [k + delta for k in self.line_index[end + 1:]]
+
+        child.tokens = self.tokens[:i_left] + mid_tokens + self.tokens[i_right:]
+        child.ids = self.ids[:i_left] + mid_ids + self.ids[i_right:]
+        child.lengths = self.lengths[:i_left] + mid_lengths + self.lengths[i_right:]
+        child.boundaries = list(accumulate(mid_lengths, initial=self.boundaries[i_left]))
+        b_mid = child.boundaries[-1]
+        child.boundaries = self.boundaries[:i_left] + child.boundaries + [k + delta for k in self.boundaries[i_right + 1:]]
+        child.log_probs = self.log_probs[:i_left] + window_log_probs + self.log_probs[tail_end:]
+        match_chars = [get_token_match_chars(token, token_id, self.model) for token, token_id in zip(mid_tokens, mid_ids)]
+        child.match_prefix = self.match_prefix[:i_left] + list(accumulate(match_chars, initial=self.match_prefix[i_left]))
+        shift = child.match_prefix[-1] - self.match_prefix[i_right]
+        child.match_prefix += [k + shift for k in self.match_prefix[i_right + 1:]]
+        child.log_prob_prefix = self.log_prob_prefix[:i_left] + \
+            list(accumulate(child.log_probs[i_left:], initial=self.log_prob_prefix[i_left]))
+
+        mid_start = self.boundaries[i_left]
+        mid_left_safe, mid_right_safe = get_safe_cuts(child.line[mid_start:b_mid],
+                                                      [k - mid_start for k in child.boundaries[i_left:i_left + len(mid_tokens) + 1]])
+        child.left_safe = self.left_safe[:i_left + 1] + mid_left_safe[1:] + self.left_safe[i_right + 1:]
+        child.right_safe = self.right_safe[:i_left] + mid_right_safe[:-1] + self.right_safe[i_right:]
+
+        child.segmented_edits = {}
+        child.windows = {}
+        child.base_segmented_edits = child.base_windows = None
+        child.score = get_sentence_score(child.log_probs, child.match_prefix[-1], len(child.line))
+        stats.stop("score.incremental_apply", timer_start)
+        return child
+
+    def score_edit(self, start, end, replacement):
+        if not self.line:
+            return calculate_ngram_score(self.sentence[:start] + replacement + self.sentence[end:],
+                                         self.model, n_order=self.n_order)
+        timer_start = stats.start()
+        window = self.get_edit_window(start, end, replacement)
+        if window is None: return -999.0
+        i_left, i_right, window_log_probs, mid_match_chars, delta = window
+
+        tail_end = min(len(self.tokens), i_right + self.n_order - 1)
+        log_probs = self.log_probs[:i_left] + window_log_probs + self.log_probs[tail_end:]
+        match_chars = self.match_prefix[i_left] + self.match_prefix[-1] - self.match_prefix[i_right] + mid_match_chars
+        score = get_sentence_score(log_probs, match_chars, len(self.line) + delta)
+        stats.stop("score.incremental_edit", timer_start)
+        return score
 
 
 if __name__ == '__main__':
@@ -0,0 +1,197 @@
+import warnings
+warnings.filterwarnings("ignore", category=UserWarning, module="jieba")
+
+import os
+import json
+import mmap
+import time
+import struct
+import marshal
+import tempfile
+import threading
+import jieba
+import logging
+from array import array
+from constant import N, alpha
+from ngram_store import NgramStore, build_ngram_store, is_ngram_store, get_capacity, string_hash
+from lexicon_store import LexiconStore, pack_lexicon, is_lexicon_store, get_default_lexicon_path
+from sentence_evaluator import NgramModel
+jieba.setLogLevel(logging.ERROR)
+
+SNAPSHOT_MAGIC = b"ASRSNAP\0"
+SNAPSHOT_VERSION = 1
+HEADER_FORMAT = "<8sII"
+SECTION_FORMAT = "<16sQQ"
+SECTION_ALIGN = 64
+
+FREQ_MAGIC = b"JIEBAFRQ"
+FREQ_HEADER_FORMAT = "<8sIQQQQ"
+FREQ_HEADER_SIZE = 64
+
+def pack_jieba_freq(freq, total):
+    capacity = get_capacity(len(freq))
+    mask = capacity - 1
+    hashes = array("Q", bytes(8 * capacity))
+    values = array("Q", bytes(8 * capacity))
+    for word, count in freq.items():
+        h = string_hash(word)
+        slot = h & mask
+        while hashes[slot]:
+            slot = (slot + 1) & mask
+        hashes[slot] = h
+        values[slot] = count
+    max_key_length = max(map(len, freq))
+    header = struct.pack(FREQ_HEADER_FORMAT, FREQ_MAGIC, 1, capacity, len(freq), total, max_key_length)
+    return header.ljust(FREQ_HEADER_SIZE, b"\0") + hashes.tobytes() + values.tobytes()
+
+class MappedFreq:
+    # Read-only stand-in for jieba's FREQ dict, answering the lookups jieba's
+    # cutters make straight from the snapshot until the real dict is loaded.
+    def __init__(self, buffer):
+        view = memoryview(buffer)
+        magic, _, self.capacity, self.n_entries, self.total, self.max_key_length = \
+            struct.unpack_from(FREQ_HEADER_FORMAT, view, 0)
+        if magic != FREQ_MAGIC:
+            raise ValueError("not a jieba frequency table")
+        self.mask = self.capacity - 1
+        hashes_end = FREQ_HEADER_SIZE + 8 * self.capacity
+        self.hashes = view[FREQ_HEADER_SIZE:hashes_end].cast("Q")
+        self.values = view[hashes_end:hashes_end + 8 * self.capacity].cast("Q")
+
+    def find(self, word):
+        h = string_hash(word)
+        hashes = self.hashes
+        mask = self.mask
+        slot = h & mask
+        while True:
+            k = hashes[slot]
+            if k == h:
+                return slot
+            if not k:
+                return -1
+            slot = (slot + 1) & mask
+
+    def __contains__(self, word):
+        return self.find(word) >= 0
+
+    def __getitem__(self, word):
+        slot = self.find(word)
+        if slot < 0:
+            raise KeyError(word)
+        return self.values[slot]
+
+    def get(self, word, default=None):
+        slot = self.find(word)
+        return self.values[slot] if slot >= 0 else default
+
+    def __len__(self):
+        return self.n_entries
+
+def get_ngram_store_bytes(model_path):
+    if is_ngram_store(model_path):
+        with open(model_path, "rb") as r:
+            return r.read()
+    fd, tmp_path = tempfile.mkstemp(suffix=".bin")
+    os.close(fd)
+    try:
+        build_ngram_store(model_path, tmp_path)
+        with open(tmp_path, "rb") as r:
+            return r.read()
+    finally:
+        os.remove(tmp_path)
+
+def get_lexicon_store_bytes(lexicon_path):
+    if is_lexicon_store(lexicon_path):
+        with open(lexicon_path, "rb") as r:
+            return r.read()
+    with open(lexicon_path, "r", encoding="utf-8") as r:
+        return pack_lexicon(json.load(r))
+
+def build_snapshot(snapshot_path="model.snapshot", model_path="ngram.db", lexicon_path="lexicon.bin"):
+    jieba.dt.check_initialized()
+    meta = {
+        "version": SNAPSHOT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "N": N,
+        "alpha": alpha,
+        "sources": {os.path.basename(p): os.path.getmtime(p) for p in (model_path, lexicon_path)},
+    }
+    sections = [
+        ("meta", json.dumps(meta).encode("utf-8")),
+        ("ngram", get_ngram_store_bytes(model_path)),
+        ("lexicon", get_lexicon_store_bytes(lexicon_path)),
+        ("jieba_freq", pack_jieba_freq(jieba.dt.FREQ, jieba.dt.total)),
+        ("jieba_dict", marshal.dumps((jieba.dt.FREQ, jieba.dt.total))),
+    ]
+
+    table_size = struct.calcsize(HEADER_FORMAT) + struct.calcsize(SECTION_FORMAT) * len(sections)
+    offset = -(-table_size // SECTION_ALIGN) * SECTION_ALIGN
+    table = [struct.pack(HEADER_FORMAT, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(sections))]
+    body = []
+    for name, data in sections:
+        table.append(struct.pack(SECTION_FORMAT, name.encode("ascii"), offset, len(data)))
+        padding = -len(data) % SECTION_ALIGN
+        body.append(data + b"\0" * padding)
+        offset += len(data) + padding
+
+    tmp_path = snapshot_path + ".tmp"
+    with open(tmp_path, "wb") as w:
+        header = b"".join(table)
+        w.write(header.ljust(-(-table_size // SECTION_ALIGN) * SECTION_ALIGN, b"\0"))
+        for data in body:
+            w.write(data)
+    os.replace(tmp_path, snapshot_path)
+
+def is_snapshot(path):
+    if not os.path.isfile(path):
+        return False
+    with open(path, "rb") as r:
+        return r.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+
+class Snapshot:
+    def __init__(self, snapshot_path):
+        self.path = snapshot_path
+        with open(snapshot_path, "rb") as r:
+            self.mm = mmap.mmap(r.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, n_sections = struct.unpack_from(HEADER_FORMAT, self.mm, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"{snapshot_path} is not a version {SNAPSHOT_VERSION} model snapshot")
+
+        view = memoryview(self.mm)
+        self.sections = {}
+        pos = struct.calcsize(HEADER_FORMAT)
+        for _ in range(n_sections):
+            name, offset, length = struct.unpack_from(SECTION_FORMAT, self.mm, pos)
+            self.sections[name.rstrip(b"\0").decode("ascii")] = view[offset:offset + length]
+            pos += struct.calcsize(SECTION_FORMAT)
+
+        self.meta = json.loads(bytes(self.sections["meta"]).decode("utf-8"))
+        if self.meta["N"] != N or self.meta["alpha"] != alpha:
+            raise ValueError(f"{snapshot_path} was built with N={self.meta['N']}, alpha={self.meta['alpha']}; rebuild it")
+
+    def get_ngram_model(self):
+        return NgramModel(store=NgramStore(buffer=self.sections["ngram"]))
+
+    def get_lexicon(self, top_k=None):
+        return LexiconStore(buffer=self.sections["lexicon"], top_k=top_k)
+
+    def install_jieba(self, background=True):
+        with jieba.dt.lock:
+            if jieba.dt.initialized:
+                return
+            freq = MappedFreq(self.sections["jieba_freq"])
+            jieba.dt.FREQ, jieba.dt.total = freq, freq.total
+            jieba.dt.initialized = True
+
+        def load_dict():
+            jieba.dt.FREQ, jieba.dt.total = marshal.loads(self.sections["jieba_dict"])
+
+        if background:
+            threading.Thread(target=load_dict, daemon=True).start()
+        else:
+            load_dict()
+
+if __name__ == '__main__':
+    build_snapshot("model.snapshot", "ngram.bin" if os.path.exists("ngram.bin") else "ngram.db",
+                   get_default_lexicon_path())
@@ -0,0 +1,45 @@
+from time import perf_counter
+from constant import stats_enabled
+
+class Stats:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.counters = {}
+        self.timers = {}
+
+    def incr(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def start(self):
+        return perf_counter() if self.enabled else None
+
+    def stop(self, name, start):
+        if start is None:
+            return
+        elapsed = perf_counter() - start
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [1, elapsed, elapsed]
+        else:
+            timer[0] += 1
+            timer[1] += elapsed
+            if elapsed > timer[2]:
+                timer[2] = elapsed
+
+    def reset(self):
+        self.counters = {}
+        self.timers = {}
+
+    def snapshot(self):
+        counters = dict(self.counters)
+        timers = {name: {"count": count, "total_ms": total * 1000, "mean_ms": total / count * 1000, "max_ms": peak * 1000}
+                  for name, (count, total, peak) in list(self.timers.items())}
+        hit_rates = {}
+        for name, hits in counters.items():
+            if name.endswith(".hits"):
+                prefix = name[:-len(".hits")]
+                lookups = hits + counters.get(prefix + ".misses", 0)
+                hit_rates[prefix] = hits / lookups if lookups else 0.0
+        return {"enabled": self.enabled, "counters": counters, "timers": timers, "hit_rates": hit_rates}
+
+stats = Stats(stats_enabled)
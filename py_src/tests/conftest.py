@@ -0,0 +1,78 @@
+import os
+import sys
+import random
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jieba
+from stats import stats
+
+BASE_SENTENCES = ["这是一个非常正常的句子", "研究人员正在实验室里进行科学实验", "母亲叮嘱我学习要深钻细研",
+                  "炮眼打好了炸药怎么装", "苹果园里有很多的苹果", "今天去哪里玩比较好", "你居然欺负我"]
+
+def get_words():
+    jieba.dt.check_initialized()
+    return sorted(w for w, f in jieba.dt.FREQ.items() if f > 2000 and all('一' <= c <= '龥' for c in w))
+
+def write_corpora(directory, n_metadata=3000, n_novels=600, n_thu=1500, seed=0):
+    rng = random.Random(seed)
+    words = get_words()
+    common = words[::max(1, len(words) // 1500)]
+    with open(os.path.join(directory, "corpus_cleaned_metadata.txt"), "w", encoding="utf-8") as w:
+        for i in range(n_metadata):
+            if i % 10 == 0:
+                w.write(rng.choice(BASE_SENTENCES) + "\n")
+            else:
+                w.write("".join(rng.choice(common) for _ in range(rng.randint(3, 10))) + "\n")
+    with open(os.path.join(directory, "corpus_cleaned_novels.txt"), "w", encoding="utf-8") as w:
+        for _ in range(n_novels):
+            w.write("".join(rng.choice(words) for _ in range(rng.randint(3, 12))) + "\n")
+    with open(os.path.join(directory, "corpus_cleaned_thu.txt"), "w", encoding="utf-8") as w:
+        for word in common[:n_thu]:
+            w.write(word + "\n")
+
+def build_models(directory):
+    import get_lexicon
+    import get_ngram
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        get_lexicon.entry()
+        get_ngram.train_entry()
+    finally:
+        os.chdir(cwd)
+
+@pytest.fixture(scope="session")
+def model_dir(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("model"))
+    write_corpora(directory)
+    build_models(directory)
+    return directory
+
+@pytest.fixture(scope="session")
+def noisy_sentences(model_dir):
+    rng = random.Random(1)
+    with open(os.path.join(model_dir, "corpus_cleaned_metadata.txt"), encoding="utf-8") as r:
+        lines = [line.strip() for line in r if line.strip()]
+    chars = [c for c in "".join(lines[:500])]
+    sentences = []
+    for line in rng.sample(lines, 60):
+        chars_in_line = list(line)
+        for _ in range(2):
+            chars_in_line[rng.randrange(len(chars_in_line))] = rng.choice(chars)
+        sentences.append("".join(chars_in_line))
+    return sentences
+
+@pytest.fixture
+def model_paths(model_dir):
+    return os.path.join(model_dir, "ngram.bin"), os.path.join(model_dir, "lexicon.bin")
+
+@pytest.fixture
+def stats_enabled():
+    enabled = stats.enabled
+    stats.enabled = True
+    stats.reset()
+    yield stats
+    stats.enabled = enabled
+    stats.reset()
@@ -0,0 +1,15 @@
+from corrector import SentenceCorrector
+from constant import correct_threshold
+
+def test_batch_matches_single_corrections(model_paths, noisy_sentences):
+    corrector = SentenceCorrector(*model_paths)
+    sentences = noisy_sentences[:20] + noisy_sentences[:5]
+    assert corrector.correct_batch(sentences, correct_threshold) == [corrector.correct(s, correct_threshold) for s in sentences]
+
+def test_batch_shares_bounded_caches(model_paths, noisy_sentences, stats_enabled):
+    corrector = SentenceCorrector(*model_paths)
+    corrector.correct_batch(noisy_sentences[:20] * 2 + [s + "了" for s in noisy_sentences[:20]], float("inf"))
+    counters = stats_enabled.snapshot()["counters"]
+    assert counters["batch_candidates.hits"] > 0
+    cache = corrector.ngram_model.cache
+    assert len(cache) <= cache.max_entries
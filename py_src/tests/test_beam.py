@@ -0,0 +1,29 @@
+import random
+from corrector import SentenceCorrector
+from sentence_evaluator import IncrementalScorer
+
+SCORER_FIELDS = ["line", "line_index", "tokens", "ids", "lengths", "boundaries", "log_probs", "match_prefix",
+                 "log_prob_prefix", "left_safe", "right_safe", "score"]
+
+def test_applied_edits_match_a_fresh_scorer(model_paths, noisy_sentences):
+    corrector = SentenceCorrector(*model_paths)
+    model = corrector.ngram_model
+    rng = random.Random(2)
+    words = sorted({w for s in noisy_sentences for w in IncrementalScorer(s, model).tokens})
+    for sentence in noisy_sentences[:30]:
+        scorer = IncrementalScorer(sentence + "，" + rng.choice(noisy_sentences), model)
+        for _ in range(5):
+            start = rng.randrange(len(scorer.sentence))
+            end = min(len(scorer.sentence), start + rng.randint(1, 3))
+            word = rng.choice(words)
+            expected = scorer.score_edit(start, end, word)
+            scorer = scorer.apply_edit(start, end, word)
+            fresh = IncrementalScorer(scorer.sentence, model)
+            assert scorer.score == expected
+            assert {k: getattr(scorer, k) for k in SCORER_FIELDS} == {k: getattr(fresh, k) for k in SCORER_FIELDS}
+
+def test_beam_matches_full_rescoring(model_paths, noisy_sentences):
+    incremental = SentenceCorrector(*model_paths, decoder="beam")
+    full = SentenceCorrector(*model_paths, decoder="beam", incremental_scoring=False)
+    sentences = [a + "，" + b for a, b in zip(noisy_sentences[:20], noisy_sentences[20:40])]
+    assert [incremental.correct(s, float("inf")) for s in sentences] == [full.correct(s, float("inf")) for s in sentences]
@@ -0,0 +1,28 @@
+import sentence_evaluator
+from corrector import SentenceCorrector
+from constant import correct_threshold
+from lru import LRUCache
+from sentence_evaluator import NgramModel, calculate_ngram_score
+
+def correct_all(model_paths, sentences, cache_entries):
+    corrector = SentenceCorrector(*model_paths)
+    corrector.ngram_model = NgramModel(model_paths[0], cache_entries=cache_entries)
+    return [corrector.correct(s, float("inf")) for s in sentences] + \
+        [corrector.correct(s, correct_threshold) for s in sentences]
+
+def test_cached_lookups_give_identical_results(model_paths, noisy_sentences, monkeypatch, stats_enabled):
+    sentences = noisy_sentences[:30] * 2
+    cached = correct_all(model_paths, sentences, 200000)
+    evicting = correct_all(model_paths, sentences, 16)
+    counters = stats_enabled.snapshot()["counters"]
+    assert counters["ngram_cache.hits"] > 0 and counters["segment_cache.hits"] > 0
+
+    monkeypatch.setattr(sentence_evaluator, "segment_cache", None)
+    assert correct_all(model_paths, sentences, 0) == cached == evicting
+
+def test_small_segment_cache_gives_identical_scores(model_paths, noisy_sentences, monkeypatch):
+    model = NgramModel(model_paths[0], cache_entries=0)
+    monkeypatch.setattr(sentence_evaluator, "segment_cache", None)
+    expected = [calculate_ngram_score(s, model) for s in noisy_sentences]
+    monkeypatch.setattr(sentence_evaluator, "segment_cache", LRUCache(4))
+    assert [calculate_ngram_score(s, model) for s in noisy_sentences * 2] == expected * 2
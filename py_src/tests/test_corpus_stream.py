@@ -0,0 +1,45 @@
+import os
+import sys
+import random
+import subprocess
+from corpus_stream import iter_unique_lines
+
+def test_unique_lines_split_oversized_buckets():
+    rng = random.Random(0)
+    lines = ["".join(rng.choice("甲乙丙丁戊己庚辛") for _ in range(rng.randint(1, 6))) for _ in range(5000)]
+    unique = list(iter_unique_lines(iter(lines), n_buckets=4, max_bucket_bytes=256))
+    assert len(unique) == len(set(unique))
+    assert set(unique) == set(lines)
+
+def test_unique_lines_keep_repeated_line():
+    assert list(iter_unique_lines(iter(["重复"] * 2000), n_buckets=2, max_bucket_bytes=64)) == ["重复"]
+
+FEEDER_SCRIPT = """
+import sys
+sys.path.insert(0, {path!r})
+from multiprocessing import Pool
+from corpus_stream import bounded_imap_unordered
+
+def fail_on_three(x):
+    if x == 3:
+        raise ValueError("boom")
+    return x
+
+if __name__ == "__main__":
+    try:
+        with Pool(2) as pool:
+            for result in bounded_imap_unordered(pool, fail_on_three, range(1000), 2):
+                pass
+    except ValueError:
+        pass
+    with Pool(2) as pool:
+        for result in bounded_imap_unordered(pool, fail_on_three, range(4, 1000), 2):
+            break
+    print("done")
+"""
+
+def test_bounded_imap_unordered_stops_feeder(tmp_path):
+    script = tmp_path / "feeder.py"
+    script.write_text(FEEDER_SCRIPT.format(path=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    result = subprocess.run([sys.executable, str(script)], capture_output=True, text=True, timeout=60)
+    assert result.stdout.strip() == "done"
@@ -0,0 +1,57 @@
+import os
+import json
+from corrector import SentenceCorrector
+from constant import correct_threshold
+from lexicon_store import LexiconStore
+from result_cache import CachedCorrector
+from corrector_server import handle_correct, handle_batch
+
+def test_default_lexicon_falls_back_to_token_dict(model_paths, noisy_sentences, tmp_path, monkeypatch):
+    model_path, lexicon_path = model_paths
+    store = LexiconStore(lexicon_path)
+    with open(tmp_path / "token_dict.json", "w", encoding="utf-8") as w:
+        json.dump({key: store[key] for key in store}, w, ensure_ascii=False)
+    store.close()
+    monkeypatch.chdir(tmp_path)
+
+    corrector = SentenceCorrector(model_path)
+    assert corrector.model_files == [model_path, "token_dict.json"]
+    expected = SentenceCorrector(model_path, lexicon_path)
+    assert [corrector.correct(s, correct_threshold) for s in noisy_sentences[:10]] == \
+        [expected.correct(s, correct_threshold) for s in noisy_sentences[:10]]
+
+def test_debugger_falls_back_to_token_dict(model_paths, tmp_path, monkeypatch, capsys):
+    from debugger import debug_tokens_status
+    model_path, lexicon_path = model_paths
+    store = LexiconStore(lexicon_path)
+    with open(tmp_path / "token_dict.json", "w", encoding="utf-8") as w:
+        json.dump({key: store[key] for key in store}, w, ensure_ascii=False)
+    store.close()
+    db_path = os.path.join(os.path.dirname(model_path), "ngram.db")
+    debug_tokens_status(["苹果", "实验"], [], lexicon_path, db_path)
+    expected = capsys.readouterr().out
+    monkeypatch.chdir(tmp_path)
+
+    debug_tokens_status(["苹果", "实验"], [], model_path=db_path)
+    assert capsys.readouterr().out == expected
+
+def test_result_shapes_do_not_depend_on_the_deadline(model_paths, noisy_sentences):
+    corrector = SentenceCorrector(*model_paths)
+    cached = CachedCorrector(SentenceCorrector(*model_paths))
+    sentence = noisy_sentences[0]
+    for target in (corrector, cached, cached):
+        assert len(target.correct(sentence, float("inf"))) == 3
+        assert [len(r) for r in target.correct_batch([sentence], float("inf"))] == [3]
+        assert target.correct_within(sentence, float("inf"), None) == target.correct(sentence, float("inf")) + (True,)
+        assert [len(r) for r in target.correct_batch_within([sentence, sentence], float("inf"), 0)] == [4, 4]
+    assert corrector.correct_within(sentence, float("inf"), 0)[3] is False
+    session = corrector.get_session("s")
+    assert session.update(sentence) == corrector.correct(sentence, correct_threshold)
+    assert session.update_within(sentence, correct_threshold, None) == corrector.correct(sentence, correct_threshold) + (True,)
+
+def test_replies_carry_finished_only_with_a_deadline(model_paths, noisy_sentences):
+    corrector = SentenceCorrector(*model_paths)
+    assert "finished" not in handle_correct(corrector, {"text": noisy_sentences[0]})
+    assert handle_correct(corrector, {"text": noisy_sentences[0], "deadline_ms": 1000})["finished"] in (True, False)
+    replies = handle_batch(corrector, {"texts": noisy_sentences[:3], "deadline_ms": 0, "threshold": float("inf")})["results"]
+    assert [reply["finished"] for reply in replies] == [False] * 3
@@ -0,0 +1,63 @@
+import os
+import sqlite3
+import conftest
+from ngram_store import unpack_key
+from sentence_evaluator import NgramModel, calculate_ngram_score
+
+def read_grams(db_path):
+    conn = sqlite3.connect(db_path)
+    vocab = dict(conn.execute("SELECT id, token FROM vocab"))
+    grams = {tuple(vocab[i] for i in unpack_key(gram, order)): (count, log_prob)
+             for order, gram, count, log_prob in conn.execute("SELECT order_n, gram, count, log_prob FROM ngrams")}
+    conn.close()
+    return grams
+
+def test_delta_build_matches_full_retrain(tmp_path):
+    import get_lexicon
+    import get_ngram
+    full_dir, delta_dir = tmp_path / "full", tmp_path / "delta"
+    full_dir.mkdir()
+    delta_dir.mkdir()
+    conftest.write_corpora(str(full_dir))
+    metadata_path = full_dir / "corpus_cleaned_metadata.txt"
+    lines = metadata_path.read_text(encoding="utf-8").splitlines()
+    # The lexicon counts unique lines per file, so the delta holds only lines the base corpus lacks.
+    base = lines[:len(lines) * 7 // 10]
+    base_lines = set(base)
+    delta = [line for line in lines[len(base):] if line not in base_lines]
+    metadata_path.write_text("".join(line + "\n" for line in base + delta), encoding="utf-8")
+    for name in ("corpus_cleaned_metadata.txt", "corpus_cleaned_novels.txt", "corpus_cleaned_thu.txt"):
+        (delta_dir / name).write_bytes((full_dir / name).read_bytes())
+    (delta_dir / "corpus_cleaned_metadata.txt").write_text("".join(line + "\n" for line in base), encoding="utf-8")
+    (delta_dir / "new_metadata.txt").write_text("".join(line + "\n" for line in delta), encoding="utf-8")
+
+    conftest.build_models(str(full_dir))
+    conftest.build_models(str(delta_dir))
+    before = read_grams(str(delta_dir / "ngram.db"))
+    cwd = os.getcwd()
+    os.chdir(delta_dir)
+    try:
+        get_lexicon.delta_entry("new_metadata.txt", "metadata")
+        get_ngram.delta_entry("new_metadata.txt")
+    finally:
+        os.chdir(cwd)
+
+    assert (delta_dir / "lexicon.bin").read_bytes() == (full_dir / "lexicon.bin").read_bytes()
+    grams = read_grams(str(delta_dir / "ngram.db"))
+    assert grams != before
+    assert grams == read_grams(str(full_dir / "ngram.db"))
+    delta_model, full_model = NgramModel(str(delta_dir / "ngram.bin")), NgramModel(str(full_dir / "ngram.bin"))
+    assert [calculate_ngram_score(line, delta_model) for line in delta[:50]] == \
+        [calculate_ngram_score(line, full_model) for line in delta[:50]]
+
+def test_lexicon_ties_keep_first_appearance(tmp_path):
+    import get_lexicon
+    from lexicon_store import LexiconStore
+    chars = [chr(0x4e00 + i) for i in range(300)]
+    for order in (chars, chars[::-1]):
+        lexicon_path = str(tmp_path / "lexicon.bin")
+        get_lexicon.build_lexicon({"metadata": dict.fromkeys(order, 12)}, lexicon_path)
+        store = LexiconStore(lexicon_path)
+        kept = sorted(token for key in store for token in store[key])
+        store.close()
+        assert kept == sorted(order[:3])
@@ -0,0 +1,90 @@
+import os
+import shutil
+import random
+import sqlite3
+import pytest
+import numpy as np
+from ngram_store import NgramStore, build_ngram_store, get_log_prob_codebook, quantize_log_prob
+from sentence_evaluator import NgramModel, calculate_ngram_score
+
+def copy_db(model_dir, tmp_path):
+    db_path = str(tmp_path / "ngram.db")
+    shutil.copy(os.path.join(model_dir, "ngram.db"), db_path)
+    return db_path
+
+def test_loading_a_db_does_not_write_it(model_dir, tmp_path):
+    db_path = copy_db(model_dir, tmp_path)
+    before = os.stat(db_path).st_mtime_ns, os.path.getsize(db_path)
+    model = NgramModel(db_path)
+    calculate_ngram_score("今天去哪里玩比较好", model)
+    model.conn.close()
+    assert (os.stat(db_path).st_mtime_ns, os.path.getsize(db_path)) == before
+    assert sorted(os.listdir(tmp_path)) == ["ngram.db"]
+
+def test_stale_log_probs_raise_instead_of_rewriting(model_dir, tmp_path):
+    db_path = copy_db(model_dir, tmp_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE meta SET value = '0.5' WHERE key = 'alpha'")
+    conn.commit()
+    conn.close()
+    before = os.stat(db_path).st_mtime_ns
+    with pytest.raises(ValueError, match="migrate_ngram.py"):
+        NgramModel(db_path)
+    assert os.stat(db_path).st_mtime_ns == before
+
+def read_log_probs(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT order_n, gram, log_prob FROM ngrams").fetchall()
+    conn.close()
+    return rows
+
+def test_unquantized_store_keeps_exact_log_probs(model_dir, tmp_path):
+    db_path = os.path.join(model_dir, "ngram.db")
+    store_path = str(tmp_path / "ngram.bin")
+    build_ngram_store(db_path, store_path)
+    store = NgramStore(store_path)
+    for order, gram, log_prob in read_log_probs(db_path):
+        assert store.get_log_prob(order, gram) == log_prob
+    store.close()
+
+@pytest.mark.parametrize("log_prob_bits", [8, 16])
+def test_quantized_log_probs_shrink_the_store(model_dir, tmp_path, noisy_sentences, log_prob_bits):
+    db_path = os.path.join(model_dir, "ngram.db")
+    exact_path, quantized_path = str(tmp_path / "exact.bin"), str(tmp_path / "quantized.bin")
+    build_ngram_store(db_path, exact_path)
+    build_ngram_store(db_path, quantized_path, log_prob_bits=log_prob_bits)
+    assert os.path.getsize(quantized_path) < os.path.getsize(exact_path)
+
+    store = NgramStore(quantized_path)
+    rows = read_log_probs(db_path)
+    codebook = get_log_prob_codebook([log_prob for _, _, log_prob in rows], log_prob_bits)
+    for order, gram, log_prob in rows:
+        assert store.get_log_prob(order, gram) == codebook[quantize_log_prob(codebook, log_prob)]
+    by_order = {}
+    for order, gram, log_prob in rows:
+        by_order.setdefault(order, []).append((gram, log_prob))
+    for order, grams in by_order.items():
+        keys = np.array([gram for gram, _ in grams], dtype=np.uint64)
+        assert store.get_log_probs(order, keys).tolist() == [store.get_log_prob(order, gram) for gram, _ in grams]
+    store.close()
+
+    exact_model, quantized_model = NgramModel(exact_path), NgramModel(quantized_path)
+    diffs = [abs(calculate_ngram_score(s, exact_model) - calculate_ngram_score(s, quantized_model)) for s in noisy_sentences]
+    assert sum(diffs) / len(diffs) < (1.0 if log_prob_bits == 8 else 0.05)
+
+def test_log_prob_codebook_bounds_the_error():
+    rng = random.Random(0)
+    log_probs = [-rng.expovariate(0.3) for _ in range(20000)]
+    codebook = get_log_prob_codebook(log_probs, 8)
+    assert len(codebook) <= 256 and codebook == sorted(set(codebook))
+    errors = sorted(abs(codebook[quantize_log_prob(codebook, log_prob)] - log_prob) for log_prob in log_probs)
+    assert errors[len(errors) // 2] < 0.01
+    assert errors[-len(errors) // 100] < 1.0
+
+def test_failed_chunk_raises_and_removes_its_runs(tmp_path, monkeypatch):
+    import tempfile
+    from get_ngram import process_chunk_to_runs
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    with pytest.raises(TypeError):
+        process_chunk_to_runs([[1, 2, 3], [4, None]])
+    assert os.listdir(tmp_path) == []
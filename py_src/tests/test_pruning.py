@@ -0,0 +1,10 @@
+from corrector import SentenceCorrector
+from constant import correct_threshold
+
+def test_pruned_search_matches_exhaustive_search(model_paths, noisy_sentences, stats_enabled):
+    pruned = SentenceCorrector(*model_paths, candidate_pruning=True, batch_scoring=False)
+    exhaustive = SentenceCorrector(*model_paths, candidate_pruning=False, batch_scoring=False)
+    sentences = noisy_sentences + [a + "，" + b for a, b in zip(noisy_sentences[:20], noisy_sentences[20:40])]
+    for threshold in (correct_threshold, float("inf")):
+        assert [pruned.correct(s, threshold) for s in sentences] == [exhaustive.correct(s, threshold) for s in sentences]
+    assert stats_enabled.snapshot()["counters"]["correct.candidates_pruned"] > 0
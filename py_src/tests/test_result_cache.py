@@ -0,0 +1,34 @@
+import os
+import shutil
+from constant import correct_threshold
+from corrector_server import ModelSlot, load_corrector
+
+def make_slot(model_paths, tmp_path):
+    paths = []
+    for path in model_paths:
+        paths.append(str(tmp_path / os.path.basename(path)))
+        shutil.copy(path, paths[-1])
+    cache_path = str(tmp_path / "result_cache.json")
+    return ModelSlot(load_corrector(*paths, None, 100, cache_path, background=False),
+                     lambda: load_corrector(*paths, None, 100, cache_path, background=False)), paths
+
+def test_reload_with_unchanged_model_keeps_cached_results(model_paths, noisy_sentences, tmp_path):
+    slot, _ = make_slot(model_paths, tmp_path)
+    slot.corrector.correct(noisy_sentences[0], correct_threshold)
+    assert slot.reload() == 1
+    assert slot.reload(force=True) == 2
+    assert len(slot.corrector.cache) == 1
+
+def test_changed_model_fingerprint_discards_cached_results(model_paths, noisy_sentences, tmp_path):
+    slot, (model_path, _) = make_slot(model_paths, tmp_path)
+    old = slot.corrector
+    results = [old.correct(s, correct_threshold) for s in noisy_sentences[:5]]
+    assert len(old.cache) == 5
+    st = os.stat(model_path)
+    os.utime(model_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+    assert slot.reload() == 2
+    assert slot.corrector is not old and slot.corrector.fingerprint != old.fingerprint
+    assert len(slot.corrector.cache) == 0
+    assert [slot.corrector.correct(s, correct_threshold) for s in noisy_sentences[:5]] == results
+    assert len(slot.corrector.cache) == 5
@@ -0,0 +1,21 @@
+import os
+import pytest
+from corrector import SentenceCorrector
+from constant import correct_threshold
+from sentence_evaluator import NgramModel, calculate_ngram_score, calculate_ngram_scores
+
+@pytest.mark.parametrize("model_file", ["ngram.bin", "ngram.db"])
+def test_batch_scores_match_scalar_scores(model_dir, noisy_sentences, model_file):
+    model = NgramModel(os.path.join(model_dir, model_file))
+    sentences = noisy_sentences + ["", "，。", "今天"]
+    batch = calculate_ngram_scores(sentences, model)
+    scalar = [calculate_ngram_score(s, model) for s in sentences]
+    assert batch == pytest.approx(scalar, rel=0, abs=1e-9)
+
+def test_batch_scoring_corrects_like_scalar_scoring(model_paths, noisy_sentences):
+    batch = SentenceCorrector(*model_paths, batch_scoring=True)
+    scalar = SentenceCorrector(*model_paths, batch_scoring=False)
+    for sentence in noisy_sentences[:30]:
+        batch_result, scalar_result = batch.correct(sentence, correct_threshold), scalar.correct(sentence, correct_threshold)
+        assert batch_result[0::2] == scalar_result[0::2]
+        assert batch_result[1] == pytest.approx(scalar_result[1], rel=0, abs=1e-9)
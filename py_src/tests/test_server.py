@@ -0,0 +1,46 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from corrector_server import serve_connection
+from protocol import encode_frame, decode_body, read_frame
+
+class BlockingCorrector:
+    def __init__(self):
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+        self.started = 0
+
+    def correct_within(self, text, threshold, deadline_ms):
+        with self.lock:
+            self.started += 1
+        self.release.wait(10)
+        return text, 0.0, False, True
+
+class Models:
+    def __init__(self, corrector):
+        self.corrector = corrector
+
+def test_connection_limits_requests_in_flight(tmp_path):
+    corrector = BlockingCorrector()
+    executor = ThreadPoolExecutor(max_workers=8)
+    socket_path = str(tmp_path / "s.sock")
+
+    async def run():
+        server = await asyncio.start_unix_server(
+            lambda reader, writer: serve_connection(reader, writer, Models(corrector), executor, 2), path=socket_path)
+        async with server:
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+            for i in range(20):
+                writer.write(encode_frame({"id": i, "text": str(i)}))
+            await writer.drain()
+            await asyncio.sleep(0.3)
+            started = corrector.started
+            corrector.release.set()
+            replies = [decode_body(await read_frame(reader)) for _ in range(20)]
+            writer.close()
+            return started, replies
+
+    started, replies = asyncio.run(run())
+    executor.shutdown()
+    assert started == 2
+    assert sorted(reply["id"] for reply in replies) == list(range(20))
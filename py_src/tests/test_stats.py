@@ -0,0 +1,18 @@
+from corrector import SentenceCorrector
+from stats import stats
+
+def test_beam_timer_is_off_when_stats_disabled(model_paths, noisy_sentences):
+    corrector = SentenceCorrector(*model_paths, decoder="beam")
+    stats.reset()
+    for sentence in noisy_sentences[:5]:
+        corrector.correct(sentence, threshold=float("inf"))
+    assert not stats.enabled
+    assert "correct.beam" not in stats.snapshot()["timers"]
+
+def test_beam_timer_measures_the_search(model_paths, noisy_sentences, stats_enabled):
+    corrector = SentenceCorrector(*model_paths, decoder="beam")
+    for sentence in noisy_sentences[:5]:
+        corrector.correct(sentence, threshold=float("inf"))
+    timers = stats_enabled.snapshot()["timers"]
+    assert timers["correct.beam"]["count"] == 5
+    assert timers["correct.beam"]["max_ms"] <= timers["correct.total"]["max_ms"]
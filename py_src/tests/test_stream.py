@@ -0,0 +1,18 @@
+from corrector import SentenceCorrector
+from constant import correct_threshold
+
+def get_partials(sentence, revised):
+    # Growing prefixes, then a revision of the tail as a recognizer would send it.
+    partials = [sentence[:k] for k in range(1, len(sentence) + 1)]
+    return partials + [sentence[:len(sentence) // 2] + revised[:k] for k in range(1, len(revised) + 1)]
+
+def test_stream_session_matches_correct_for_every_partial(model_paths, noisy_sentences):
+    corrector = SentenceCorrector(*model_paths)
+    reference = SentenceCorrector(*model_paths)
+    for threshold in (correct_threshold, float("inf")):
+        for i, sentence in enumerate(noisy_sentences[:12]):
+            session_id = f"{threshold}-{i}"
+            session = corrector.get_session(session_id)
+            for partial in get_partials(sentence + "，" + noisy_sentences[i + 12], noisy_sentences[i + 24]):
+                assert session.update(partial, threshold) == reference.correct(partial, threshold)
+            corrector.close_session(session_id)
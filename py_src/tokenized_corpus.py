@@ -0,0 +1,132 @@
+import os
+import json
+import shutil
+import hashlib
+import warnings
+warnings.filterwarnings("ignore", category=UserWarning, module="jieba")
+
+import jieba
+import logging
+from array import array
+from tqdm import tqdm
+from multiprocessing import Pool, cpu_count
+from corpus_stream import iter_lines, iter_batches, bounded_imap
+from constant import stream_batch_size, stream_max_pending, tokenized_cache_dir
+jieba.setLogLevel(logging.ERROR)
+
+# A tokenized corpus is a directory named after the source file's sha1 holding
+# vocab.txt (one token per line, line number = token id), tokens.bin (uint32
+# stream of [n_tokens, id_1 .. id_n] per corpus line, in file order) and meta.json.
+# Token ids are therefore numbered in order of first appearance.
+
+def get_file_hash(filepath):
+    h = hashlib.sha1()
+    with open(filepath, "rb") as r:
+        for block in iter(lambda: r.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def segment_chunk(lines_chunk):
+    return [jieba.lcut(line) for line in lines_chunk]
+
+def load_cache_index(cache_dir):
+    index_path = os.path.join(cache_dir, "index.json")
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as r:
+            return json.load(r)
+    return {}
+
+def save_cache_index(cache_dir, index):
+    index_path = os.path.join(cache_dir, "index.json")
+    with open(index_path + ".tmp", "w", encoding="utf-8") as w:
+        json.dump(index, w, ensure_ascii=False)
+    os.replace(index_path + ".tmp", index_path)
+
+def get_corpus_hash(filepath, cache_dir):
+    stat = os.stat(filepath)
+    index = load_cache_index(cache_dir)
+    entry = index.get(os.path.abspath(filepath))
+    if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+        return entry["hash"]
+    file_hash = get_file_hash(filepath)
+    index[os.path.abspath(filepath)] = {"size": stat.st_size, "mtime": stat.st_mtime, "hash": file_hash}
+    save_cache_index(cache_dir, index)
+    return file_hash
+
+def tokenize_corpus(filepath, cache_dir=tokenized_cache_dir):
+    if not os.path.exists(filepath):
+        return None
+    os.makedirs(cache_dir, exist_ok=True)
+    out_dir = os.path.join(cache_dir, get_corpus_hash(filepath, cache_dir))
+    if os.path.exists(os.path.join(out_dir, "meta.json")):
+        return out_dir
+
+    tmp_dir = out_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    vocab = {}
+    n_lines = n_tokens = 0
+    with open(os.path.join(tmp_dir, "tokens.bin"), "wb") as w, Pool(cpu_count()) as pool:
+        chunks = iter_batches(iter_lines(filepath), stream_batch_size)
+        for segmented in tqdm(bounded_imap(pool, segment_chunk, chunks, stream_max_pending), desc=f"Tokenizing {filepath}"):
+            ids = array("I")
+            for tokens in segmented:
+                ids.append(len(tokens))
+                ids.extend(vocab.setdefault(token, len(vocab)) for token in tokens)
+                n_tokens += len(tokens)
+            n_lines += len(segmented)
+            ids.tofile(w)
+
+    with open(os.path.join(tmp_dir, "vocab.txt"), "w", encoding="utf-8") as w:
+        for token in vocab:
+            w.write(token + "\n")
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as w:
+        json.dump({"source": os.path.abspath(filepath), "lines": n_lines, "tokens": n_tokens, "vocab_size": len(vocab)}, w, ensure_ascii=False)
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.rename(tmp_dir, out_dir)
+    return out_dir
+
+def load_vocab(corpus_dir):
+    with open(os.path.join(corpus_dir, "vocab.txt"), "r", encoding="utf-8") as r:
+        return [line[:-1] for line in r]
+
+def iter_token_ids(corpus_dir, block_size=1 << 18):
+    with open(os.path.join(corpus_dir, "tokens.bin"), "rb") as r:
+        ids = array("I")
+        pos = 0
+        while True:
+            if pos < len(ids) and pos + ids[pos] < len(ids):
+                end = pos + 1 + ids[pos]
+                yield ids[pos + 1:end]
+                pos = end
+                continue
+            block = r.read(4 * block_size)
+            if not block:
+                break
+            ids = ids[pos:]
+            ids.frombytes(block)
+            pos = 0
+
+def build_shared_vocab(corpus_dirs, vocab=None):
+    # Model token ids start at 1 so that 0 can stand for out-of-vocabulary. An existing
+    # vocab keeps its ids and new tokens are numbered after it.
+    vocab = dict(vocab) if vocab else {}
+    remaps = []
+    for corpus_dir in corpus_dirs:
+        remaps.append(array("I", (vocab.setdefault(token, len(vocab) + 1) for token in load_vocab(corpus_dir))))
+    return vocab, remaps
+
+def iter_shared_token_ids(corpus_dir, remap):
+    for ids in iter_token_ids(corpus_dir):
+        yield [remap[i] for i in ids]
+
+def iter_tokenized_lines(corpus_dir):
+    vocab = load_vocab(corpus_dir)
+    for ids in iter_token_ids(corpus_dir):
+        yield [vocab[i] for i in ids]
+
+if __name__ == '__main__':
+    for f in ["corpus_cleaned_metadata.txt", "corpus_cleaned_novels.txt", "corpus_cleaned_thu.txt"]:
+        tokenize_corpus(f)